@@ -0,0 +1,518 @@
+"""Throughput benchmarks for cellom2tif.
+
+Measure the speed of reading Cellomics images (`read_image`), writing TIFF
+files (`tifffile.imsave`, with its compression ratio, with and without the
+horizontal predictor), decoding LZW and PackBits strips, opening TIFF files
+with many pages, reading a small region of a large image, and converting
+whole directory trees, on the files in ``test-data`` and on synthetic trees
+of any size. JVM startup is timed separately from per-file costs, as is the
+time taken to import the package and print the command line help, which
+should not start (or even import) the JVM.
+
+Each run appends one JSON record per line to a results file, together with
+the git revision and platform, so that runs can be compared over time::
+
+    $ python benchmarks/benchmark.py -o benchmarks/results.jsonl
+    $ python benchmarks/benchmark.py -n 2000 -o benchmarks/results.jsonl
+    $ python benchmarks/benchmark.py --compare benchmarks/results.jsonl
+
+Run from the root of the repository.
+"""
+from __future__ import division, print_function
+
+import os
+import io
+import sys
+import json
+import time
+import zlib
+import shutil
+import struct
+import argparse
+import platform
+import tempfile
+import multiprocessing
+import subprocess
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from cellom2tif import cellom2tif
+from cellom2tif import tifffile as tif
+from cellom2tif.filetypes import is_cellomics_image
+
+
+def make_synthetic_tree(root, n_files, shape=(512, 512), per_dir=500,
+                        seed=0):
+    """Write a tree of synthetic .C01 files for benchmarking.
+
+    The images are smooth 12-bit noise, similar in compressibility to
+    fluorescence images, and follow the Cellomics naming scheme with three
+    channels per field.
+
+    Parameters
+    ----------
+    root : string
+        The directory in which to create the tree.
+    n_files : int
+        The number of files to write.
+    shape : (int, int), optional
+        The image shape.
+    per_dir : int, optional
+        The number of files in each subdirectory.
+    seed : int, optional
+        The random seed.
+
+    Returns
+    -------
+    root : string
+        The root of the tree.
+    """
+    random = np.random.RandomState(seed)
+    height, width = shape
+    images = []
+    for i in range(3):
+        noise = random.randint(0, 64, size=shape)
+        base = np.add.outer(np.arange(height), np.arange(width)) % 2048
+        images.append((base + noise + 1000 * i).astype('<u2'))
+    for i in range(n_files):
+        field, channel = divmod(i, 3)
+        path = os.path.join(root, 'd%i' % (i // per_dir))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        fn = os.path.join(path, 'SYNTH_000000000001_A01f%04id%i.C01'
+                          % (field, channel))
+        image = images[channel]
+        header = struct.pack('<IiiHHIIiiII', 40, width, height, 1, 16, 0,
+                             image.nbytes, 0, 0, 0, 0) + b'\0' * 12
+        with open(fn, 'wb') as fout:
+            fout.write(b'\x00\x00\x00\x10')
+            fout.write(zlib.compress(header + image.tobytes(), 1))
+    return root
+
+
+def list_images(root):
+    """Return the sorted Cellomics images under `root`."""
+    return sorted(os.path.join(path, fn) for path, _, files in os.walk(root)
+                  for fn in files if is_cellomics_image(fn))
+
+
+def result(name, seconds, n_files, nbytes, **params):
+    """Return a benchmark record."""
+    return {'name': name, 'params': params, 'seconds': seconds,
+            'files': n_files, 'megabytes': nbytes / 2**20,
+            'files_per_s': n_files / seconds if seconds else None,
+            'mb_per_s': nbytes / 2**20 / seconds if seconds else None}
+
+
+def bench_import(repeat=5):
+    """Time importing cellom2tif and printing the CLI help, in new processes.
+
+    Neither should import javabridge or bioformats, which is recorded as
+    ``heavy_imports`` so that a regression shows up in the results.
+    """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    check = ("import sys, cellom2tif; print(' '.join(m for m in "
+             "('javabridge', 'bioformats') if m in sys.modules))")
+    commands = [('import', [sys.executable, '-c', check]),
+                ('cli_help', [sys.executable,
+                              os.path.join(root, 'bin', 'cellom2tif'), '-h'])]
+    results = []
+    for name, command in commands:
+        times = []
+        for _ in range(repeat):
+            start = time.time()
+            output = subprocess.check_output(command, cwd=root)
+            times.append(time.time() - start)
+        record = result(name, min(times), 0, 0)
+        if name == 'import':
+            record['heavy_imports'] = output.decode().split()
+        results.append(record)
+    return results
+
+
+def bench_jvm_startup():
+    """Time starting the JVM, which happens once per process."""
+    start = time.time()
+    cellom2tif.start()
+    return [result('jvm_startup', time.time() - start, 0, 0)]
+
+
+def bench_read(files, backend):
+    """Time `read_image` on each file, after the JVM has started."""
+    nbytes = 0
+    start = time.time()
+    for fn in files:
+        nbytes += cellom2tif.read_image(fn, backend=backend).nbytes
+    return [result('read_image', time.time() - start, len(files), nbytes,
+                   backend=backend)]
+
+
+def bench_imsave(images, levels=range(10), predictors=(False, True),
+                 repeat=3):
+    """Time encoding `images` to TIFF at each compression level.
+
+    Each level is timed with and without the horizontal predictor, and the
+    compression ratio over all images is recorded, so that the size and
+    speed of the options can be compared.
+    """
+    results = []
+    nbytes = sum(image.nbytes for image in images)
+    for level in levels:
+        for predictor in predictors:
+            if predictor and not level:
+                continue  # the predictor requires compression
+            start = time.time()
+            for _ in range(repeat):
+                size = 0
+                for image in images:
+                    buf = io.BytesIO()
+                    tif.imsave(buf, image, compress=level,
+                               predictor=predictor)
+                    size += len(buf.getvalue())
+            record = result('imsave', time.time() - start,
+                            repeat * len(images), repeat * nbytes,
+                            compress=level, predictor=predictor)
+            record['ratio'] = nbytes / size
+            results.append(record)
+    return results
+
+
+def encode_packbits(data):
+    """Compress the byte string `data` with PackBits, for `bench_decode`."""
+    data = bytearray(data)
+    out = bytearray()
+    i, n = 0, len(data)
+    while i < n:
+        j = i + 1
+        while j < n and j - i < 128 and data[j] == data[i]:
+            j += 1
+        if j - i > 1:
+            out.append(257 - (j - i))
+            out.append(data[i])
+        else:
+            while j < n and j - i < 128 and (j + 1 == n or
+                                             data[j] != data[j + 1]):
+                j += 1
+            out.append(j - i - 1)
+            out.extend(data[i:j])
+        i = j
+    return bytes(out)
+
+
+def encode_lzw(data):
+    """Compress the byte string `data` with TIFF LZW, for `bench_decode`."""
+    out = bytearray()
+    state = [0, 0]  # bit accumulator and its number of bits
+
+    def emit(code, width):
+        acc = (state[0] << width) | code
+        nbits = state[1] + width
+        while nbits >= 8:
+            nbits -= 8
+            out.append((acc >> nbits) & 255)
+        state[:] = [acc & ((1 << nbits) - 1), nbits]
+
+    table = {bytes(bytearray([i])): i for i in range(256)}
+    width = 9
+    emit(256, width)
+    prefix = b''
+    for byte in bytearray(data):
+        char = bytes(bytearray([byte]))
+        if prefix + char in table:
+            prefix += char
+            continue
+        emit(table[prefix], width)
+        table[prefix + char] = len(table) + 2
+        # widen codes and clear the table in step with decodelzw
+        if len(table) + 2 == 4094:
+            emit(256, width)
+            table = {bytes(bytearray([i])): i for i in range(256)}
+            width = 9
+        elif len(table) + 2 in (512, 1024, 2048):
+            width += 1
+        prefix = char
+    if prefix:
+        emit(table[prefix], width)
+        if len(table) + 3 in (512, 1024, 2048):
+            width += 1
+    emit(257, width)
+    acc, nbits = state
+    if nbits:
+        out.append((acc << (8 - nbits)) & 255)
+    return bytes(out)
+
+
+def pack_ints(values, itemsize):
+    """Pack `values` into big-endian `itemsize`-bit integers."""
+    bits = np.unpackbits(values.astype('>u4').view('u1').reshape(-1, 4),
+                         axis=1)[:, 32 - itemsize:]
+    return np.packbits(bits).tobytes()
+
+
+def bench_decode(shape=(1024, 1024), repeat=3, seed=0):
+    """Time decoding multi-megabyte LZW and PackBits strips.
+
+    The strips are a 16-bit image of smooth noise, as in
+    `make_synthetic_tree`, and the same image with a dark background, which
+    has long runs of zeros. Unpacking of 12-bit integers is timed on a
+    quarter of the noise image. The Python implementations are always
+    timed, and compiled ones too if `tifffile` found them (see
+    `tifffile.accelerators`).
+    """
+    random = np.random.RandomState(seed)
+    noise = (np.add.outer(np.arange(shape[0]), np.arange(shape[1])) % 2048 +
+             random.randint(0, 64, size=shape)).astype('<u2')
+    sparse = np.where(noise > 1536, noise, 0).astype('<u2')
+    packed = noise[:shape[0] // 4]
+    cases = [('decodelzw', 'noise', noise, encode_lzw),
+             ('decodepackbits', 'noise', noise, encode_packbits),
+             ('decodelzw', 'sparse', sparse, encode_lzw),
+             ('decodepackbits', 'sparse', sparse, encode_packbits),
+             ('unpackints', 'noise', packed, None)]
+    results = []
+    for function, strip, image, encode in cases:
+        if encode is None:
+            data = pack_ints(image.ravel(), 12)
+            args = ('uint16', 12, image.shape[1])
+        else:
+            data = encode(image.tobytes())
+            args = ()
+        nbytes = image.nbytes
+        for implementation in ('python', 'native'):
+            decode = tif.ACCELERATORS[function][implementation]
+            if decode is None:
+                continue
+            start = time.time()
+            for _ in range(repeat):
+                decoded = decode(data, *args)
+            seconds = time.time() - start
+            if encode is None:
+                assert np.array_equal(decoded, image.ravel())
+            else:
+                assert decoded == image.tobytes()
+            record = result('decode', seconds, repeat, repeat * nbytes,
+                            function=function, strip=strip,
+                            implementation=implementation)
+            record['ratio'] = nbytes / len(data)
+            results.append(record)
+    return results
+
+
+def bench_open(n_pages=10000, repeat=3):
+    """Time opening a TIFF file of `n_pages` pages and reading one of them.
+
+    Reading every page is timed too, to show the cost of parsing them all.
+    """
+    fd, fn = tempfile.mkstemp(suffix='.tif', prefix='cellom2tif-bench-')
+    os.close(fd)
+    try:
+        with tif.TiffWriter(fn) as writer:
+            for i in range(n_pages):
+                writer.save(np.full((64, 64), i, '<u2'), description='page')
+        times = {'open': [], 'read_page': [], 'read_all': []}
+        for _ in range(repeat):
+            start = time.time()
+            with tif.TiffFile(fn) as tiff:
+                times['open'].append(time.time() - start)
+                tiff.asarray(key=n_pages // 2)
+                times['read_page'].append(time.time() - start)
+            start = time.time()
+            with tif.TiffFile(fn) as tiff:
+                for page in tiff.pages:
+                    page.asarray()
+            times['read_all'].append(time.time() - start)
+    finally:
+        os.remove(fn)
+    nbytes = 64 * 64 * 2
+    return [result('tiff_' + name, min(times[name]), 1,
+                   nbytes * (n_pages if name == 'read_all' else 1),
+                   pages=n_pages)
+            for name in ('open', 'read_page', 'read_all')]
+
+
+def bench_region(shape=(4096, 4096), size=64, repeat=3, seed=0):
+    """Time reading a `size` square region of a large image, and all of it.
+
+    The image is written uncompressed, in compressed strips of 16 rows, and
+    in compressed tiles of 256x256 pixels.
+    """
+    random = np.random.RandomState(seed)
+    image = (np.add.outer(np.arange(shape[0]), np.arange(shape[1])) % 2048 +
+             random.randint(0, 64, size=shape)).astype('<u2')
+    y, x = shape[0] // 3, shape[1] // 2
+    region = (y, y + size, x, x + size)
+    layouts = [('contiguous', {}),
+               ('strips', dict(compress=1, rowsperstrip=16)),
+               ('tiles', dict(compress=1, tile=(256, 256)))]
+    fd, fn = tempfile.mkstemp(suffix='.tif', prefix='cellom2tif-bench-')
+    os.close(fd)
+    results = []
+    try:
+        for layout, options in layouts:
+            tif.imsave(fn, image, **options)
+            with tif.TiffFile(fn) as tiff:
+                page = tiff.pages[0]
+                for crop in (None, region):
+                    start = time.time()
+                    for _ in range(repeat):
+                        page.asarray(region=crop)
+                    nbytes = image.nbytes if crop is None else size**2 * 2
+                    results.append(result(
+                        'read_full' if crop is None else 'read_region',
+                        time.time() - start, repeat, repeat * nbytes,
+                        layout=layout))
+    finally:
+        os.remove(fn)
+    return results
+
+
+def bench_convert(root, mode, backend, compression_level=1, jobs=2):
+    """Time converting the tree at `root` in the given mode."""
+    out_dir = tempfile.mkdtemp(prefix='cellom2tif-bench-')
+    try:
+        work = list(cellom2tif.iter_work(root, out_dir))
+        nbytes = sum(os.path.getsize(fin) for fin, _ in work)
+        start = time.time()
+        if mode == 'serial':
+            cellom2tif.convert_serial(work, compression_level, backend)
+        elif mode == 'pipelined':
+            cellom2tif.convert_pipelined(work, compression_level, backend)
+        elif mode == 'parallel':
+            cellom2tif.convert_parallel(work, jobs, compression_level,
+                                        backend)
+        seconds = time.time() - start
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    params = dict(mode=mode, backend=backend, compress=compression_level)
+    if mode == 'parallel':
+        params['jobs'] = jobs
+    record = result('convert', seconds, len(work), nbytes, **params)
+    record['note'] = 'megabytes counts compressed input'
+    return [record]
+
+
+def metadata():
+    """Return information identifying the code and machine of a run."""
+    try:
+        revision = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': revision, 'python': platform.python_version(),
+            'numpy': np.__version__, 'machine': platform.machine(),
+            'node': platform.node(), 'cpus': multiprocessing.cpu_count()}
+
+
+def run(args):
+    records = []
+    tmp_dir = None
+    if args.n_files:
+        tmp_dir = tempfile.mkdtemp(prefix='cellom2tif-synth-')
+        root = make_synthetic_tree(tmp_dir, args.n_files)
+        dataset = 'synthetic-%i' % args.n_files
+    else:
+        root = args.data
+        dataset = root
+    try:
+        files = list_images(root)
+        records.extend(bench_import())
+        # parallel conversions run their own JVMs in worker processes
+        if args.jobs > 1:
+            for backend in args.backends:
+                records.extend(bench_convert(root, 'parallel', backend,
+                                             jobs=args.jobs))
+        if 'bioformats' in args.backends:
+            records.extend(bench_jvm_startup())
+        for backend in args.backends:
+            records.extend(bench_read(files, backend))
+        records.extend(bench_imsave([cellom2tif.read_image(
+            fn, backend=args.backends[-1]) for fn in files[:100]]))
+        records.extend(bench_decode())
+        records.extend(bench_open())
+        records.extend(bench_region())
+        for backend in args.backends:
+            for mode in ('serial', 'pipelined'):
+                records.extend(bench_convert(root, mode, backend))
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        if cellom2tif.VM_STARTED and not cellom2tif.VM_KILLED:
+            cellom2tif.done()
+    run_info = metadata()
+    run_info['dataset'] = dataset
+    for record in records:
+        record.update(run_info)
+    return records
+
+
+def key(record):
+    """Return the identity of a benchmark, for comparison across runs."""
+    return (record['dataset'], record['name'],
+            json.dumps(record['params'], sort_keys=True))
+
+
+def compare(filename, fout=sys.stdout):
+    """Compare the last two runs in a results file."""
+    with open(filename) as fin:
+        records = [json.loads(line) for line in fin if line.strip()]
+    runs = []
+    for record in records:
+        stamp = (record['timestamp'], record['revision'])
+        if not runs or runs[-1][0] != stamp:
+            runs.append((stamp, {}))
+        runs[-1][1][key(record)] = record
+    if len(runs) < 2:
+        fout.write('Need at least two runs to compare.\n')
+        return
+    (old_stamp, old), (new_stamp, new) = runs[-2:]
+    fout.write('%s (%s) -> %s (%s)\n' % (old_stamp + new_stamp))
+    for k in sorted(set(old) & set(new)):
+        before, after = old[k]['seconds'], new[k]['seconds']
+        fout.write('%-60s %9.3fs %9.3fs %6.2fx\n'
+                   % (' '.join(k), before, after,
+                      before / after if after else float('nan')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-d', '--data', default='test-data',
+                        help='Directory tree of Cellomics files to use.')
+    parser.add_argument('-n', '--n-files', type=int, default=0,
+                        help='Use a synthetic tree of this many files '
+                        'instead of --data.')
+    parser.add_argument('-b', '--backends', nargs='+',
+                        default=list(cellom2tif.BACKENDS),
+                        choices=cellom2tif.BACKENDS,
+                        help='Image readers to benchmark.')
+    parser.add_argument('-j', '--jobs', type=int, default=2,
+                        help='Number of processes for parallel conversion.')
+    parser.add_argument('-o', '--output',
+                        help='Append results to this JSON-lines file.')
+    parser.add_argument('--compare', metavar='FILENAME',
+                        help='Compare the last two runs in a results file, '
+                        'instead of running the benchmarks.')
+    args = parser.parse_args()
+    if args.compare:
+        compare(args.compare)
+        return
+    records = run(args)
+    for record in records:
+        print('%-10s %-55s %8.3fs %9s files/s %9s MB/s%s' % (
+            record['name'], json.dumps(record['params'], sort_keys=True),
+            record['seconds'],
+            '%.1f' % record['files_per_s'] if record['files_per_s'] else '-',
+            '%.1f' % record['mb_per_s'] if record['mb_per_s'] else '-',
+            ' %5.2fx' % record['ratio'] if 'ratio' in record else ''))
+    if args.output:
+        with open(args.output, 'a') as fout:
+            for record in records:
+                fout.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
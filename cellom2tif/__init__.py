@@ -1,7 +1,11 @@
 """cellom2tif package: functions to convert Cellomics images to TIFF.
 """
-from .cellom2tif import read_image, convert_files
-from .filetypes import is_cellomics_image, is_cellomics_mask
+from .cellom2tif import read_image, convert_files, Converter
+from .cellomics import read_cellomics
+from .stores import ZarrPlate, HDF5Plate
+from .filetypes import (is_cellomics_image, is_cellomics_mask,
+                        parse_cellomics_name)
 
-__all__ = ['read_image', 'convert_files',
-           'is_cellomics_image', 'is_cellomics_mask']
+__all__ = ['read_image', 'convert_files', 'Converter', 'read_cellomics',
+           'ZarrPlate', 'HDF5Plate', 'is_cellomics_image', 'is_cellomics_mask',
+           'parse_cellomics_name']
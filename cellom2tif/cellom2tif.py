@@ -1,33 +1,85 @@
 from __future__ import division, absolute_import, print_function
 
+import io
 import os
+import sys
 import argparse
+import time
 import shutil
+import threading
+import itertools
+import collections
+import multiprocessing as mp
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
 
 try:
     import tifffile as tif
 except ImportError:
     from . import tifffile as tif
 
-import javabridge as jv
-import bioformats as bf
+import numpy as np
 
-from .filetypes import is_cellomics_image, is_cellomics_mask
+from .filetypes import (is_cellomics_image, is_cellomics_mask,
+                        parse_cellomics_name)
+from .cellomics import read_cellomics
+from .manifest import Manifest, MANIFEST_NAME, _sources
+from .memory import auto_heap_size, heap_budget
+from .stores import (is_zarr_chunk, encode_zarr_chunk, write_zarr_chunk,
+                     zarr_work, hdf5_work, write_hdf5)
 
 
 VM_STARTED = False
 VM_KILLED = False
 
+# javabridge and bioformats are slow to import, so they are only imported
+# when the JVM is first needed, by `_import_java`.
+jv = None
+bf = None
+
+BACKENDS = ('bioformats', 'native')
+OUTPUTS = ('tiff', 'zarr', 'hdf5')
+
 
-def start(max_heap_size='8G'):
+def _import_java():
+    """Import javabridge and bioformats, if they have not been imported."""
+    global jv, bf
+    if jv is None:
+        import javabridge as jv
+        import bioformats as bf
+
+
+def _is_image_reader(filelike):
+    """Return True if `filelike` is a `bioformats.ImageReader`.
+
+    This does not import bioformats: if it has not been imported, no reader
+    can have been created.
+    """
+    return ('bioformats' in sys.modules and
+            isinstance(filelike, sys.modules['bioformats'].ImageReader))
+
+
+def start(max_heap_size=None):
     """Start the Java Virtual Machine, enabling bioformats IO.
 
     Parameters
     ----------
     max_heap_size : string, optional
         The maximum memory usage by the virtual machine. Valid strings
-        include '256M', '64k', and '2G'. Expect to need a lot.
+        include '256M', '64k', and '2G'. Expect to need a lot. By default,
+        it is sized from the available memory (see `auto_heap_size`).
     """
+    if max_heap_size is None:
+        max_heap_size = auto_heap_size()
+    _import_java()
     jv.start_vm([], class_path=bf.JARS, max_heap_size=max_heap_size)
     global VM_STARTED
     VM_STARTED = True
@@ -40,34 +92,77 @@ def done():
     -----
     See the python-javabridge documentation for more information.
     """
+    _import_java()
     jv.kill_vm()
     global VM_KILLED
     VM_KILLED = True
 
 
-def read_image(filelike):
-    """Read an image volume from a file.
+def heap_usage(collect=False):
+    """Return the fraction of the maximum JVM heap size in use.
 
     Parameters
     ----------
-    filelike : string or bf.ImageReader
-        Either a filename containing a BioFormats image, or a
-        `bioformats.ImageReader`.
+    collect : bool, optional
+        If True, run the garbage collector first, so that only live
+        objects are counted.
 
     Returns
     -------
-    image : numpy ndarray, 5 dimensions
-        The read image.
+    usage : float or None
+        The used fraction of the heap, or None if the JVM is not running.
     """
+    if not VM_STARTED or VM_KILLED:
+        return None
+    if collect:
+        jv.static_call('java/lang/System', 'gc', '()V')
+    runtime = jv.static_call('java/lang/Runtime', 'getRuntime',
+                             '()Ljava/lang/Runtime;')
+    used = (jv.call(runtime, 'totalMemory', '()J') -
+            jv.call(runtime, 'freeMemory', '()J'))
+    return used / jv.call(runtime, 'maxMemory', '()J')
+
+
+def _check_vm(max_heap_size=None):
+    """Start the JVM if needed, or raise an error if it has been killed."""
     if not VM_STARTED:
-        start()
+        start(max_heap_size)
     if VM_KILLED:
         raise RuntimeError("The Java Virtual Machine has already been "
                            "killed, and cannot be restarted. See the "
                            "python-javabridge documentation for more "
                            "information. You must restart your program "
                            "and try again.")
-    if isinstance(filelike, bf.ImageReader):
+
+
+def read_image(filelike, backend='bioformats'):
+    """Read an image volume from a file.
+
+    Parameters
+    ----------
+    filelike : string or bf.ImageReader
+        Either a filename containing a BioFormats image, or a
+        `bioformats.ImageReader`.
+    backend : {'bioformats', 'native'}, optional
+        The reader to use. 'native' decodes Cellomics .C01 and .DIB files
+        directly with NumPy, without starting the JVM, and falls back on
+        Bio-Formats for any file it does not recognize.
+
+    Returns
+    -------
+    image : numpy ndarray, 5 dimensions
+        The read image.
+    """
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend %r. Valid backends are: %s"
+                         % (backend, ', '.join(BACKENDS)))
+    if backend == 'native' and not _is_image_reader(filelike):
+        try:
+            return read_cellomics(filelike)
+        except ValueError:
+            pass  # unrecognized variant: let Bio-Formats handle it
+    _check_vm()
+    if _is_image_reader(filelike):
         rdr = filelike
     else:
         rdr = bf.ImageReader(filelike)
@@ -121,7 +216,8 @@ def split_top(path):
 
 
 def convert_files(out_base, path, files, compression_level=1,
-                  ignore_masks=False, verbose=False):
+                  ignore_masks=False, verbose=False, backend='bioformats',
+                  pipeline=False, output='tiff', tiff_options=None):
     """Convert cellomics .C01 files to TIFF files in a sibling directory.
 
     This function is designed to be used with `os.walk`.
@@ -142,6 +238,19 @@ def convert_files(out_base, path, files, compression_level=1,
         Ignore files ending in "o1.C01".
     verbose : bool, optional
         If ``True``, print out diagnostic info during conversions.
+    backend : {'bioformats', 'native'}, optional
+        The reader used for the input files. See `read_image`.
+    pipeline : bool, optional
+        If ``True``, overlap reading, compression and writing of
+        consecutive files. See `convert_pipelined`.
+    output : {'tiff', 'zarr', 'hdf5'}, optional
+        Write a TIFF file per image, or write the images of each plate to
+        a Zarr store, ``out_base/<plate>.zarr`` (see `ZarrPlate`), or to
+        an HDF5 file, ``out_base/<plate>.h5`` (see `HDF5Plate`). HDF5
+        files are written one image at a time, even with `pipeline`.
+    tiff_options : dict, optional
+        Extra keyword arguments for `tifffile.imsave`, e.g.
+        ``{'predictor': True}``. See `write_image`.
 
     Returns
     -------
@@ -164,23 +273,1140 @@ def convert_files(out_base, path, files, compression_level=1,
     tests/all_tiff_files/image2.tif exists
     >>> shutil.rmtree(out_dir, ignore_errors=True) # cleanup after doctest
     """
+    if output not in OUTPUTS:
+        raise ValueError("Unknown output %r. Valid outputs are: %s"
+                         % (output, ', '.join(OUTPUTS)))
+    work = directory_work(out_base, path, files, ignore_masks)
+    if output == 'hdf5':
+        plates = {}
+        work = hdf5_work(work, out_base, plates, compression_level, verbose)
+        try:
+            for fin, _ in work:
+                if verbose:
+                    print(fin)
+                write_hdf5(plates, fin, read_image(fin, backend=backend))
+        finally:
+            for plate in plates.values():
+                plate.close()
+        return
+    if output == 'zarr':
+        plates = {}
+        work = zarr_work(work, out_base, plates, compression_level,
+                         reader=lambda fn: read_image(fn, backend=backend))
+        try:
+            if pipeline:
+                busy = convert_pipelined(pending(work, verbose),
+                                         compression_level, backend,
+                                         verbose=verbose)
+                if verbose:
+                    print_busy(busy)
+            else:
+                convert_serial(pending(work, verbose), compression_level,
+                               backend, verbose)
+        finally:
+            for plate in plates.values():
+                plate.close()
+        return
+    if pipeline:
+        busy = convert_pipelined(pending(work, verbose), compression_level,
+                                 backend, verbose=verbose,
+                                 tiff_options=tiff_options)
+        if verbose:
+            print_busy(busy)
+        return
+    existing = set(os.listdir(out_base))
+    for fin, fout in work:
+        if verbose:
+            print(fin)
+        if os.path.basename(fout) not in existing:
+            convert_file(fin, fout, compression_level, backend,
+                         tiff_options)
+        else:
+            if verbose:
+                print(fout, "exists")
+
+
+def directory_work(out_base, path, files, ignore_masks=False):
+    """Pair the Cellomics images in a directory with their output files.
+
+    The output directory is created if it does not exist.
+
+    Parameters
+    ----------
+    out_base : string
+        The directory in which to place converted files.
+    path : string
+        The path to the files to be converted.
+    files : list of string
+        The filenames of files, including non-.C01 files.
+    ignore_masks : bool, optional
+        Ignore files ending in "o1.C01".
+
+    Returns
+    -------
+    work : list of (string, string) tuples
+        The input and output filenames, sorted by input filename.
+    """
     if not os.path.isdir(out_base):
         os.makedirs(out_base)
     files = filter(is_cellomics_image, files)
     if ignore_masks:
         files = filter(lambda fn: not is_cellomics_mask(fn), files)
     files = sorted(files)
-    for fn in files:
-        fin = os.path.join(path, fn)
+    return [(os.path.join(path, fn), os.path.join(out_base, fn)[:-4] + '.tif')
+            for fn in files]
+
+
+def convert_file(fin, fout, compression_level=1, backend='bioformats',
+                 tiff_options=None):
+    """Convert a single Cellomics image to a TIFF file.
+
+    Parameters
+    ----------
+    fin : string or tuple of string
+        The input filename, or several filenames of the same shape, which
+        are written as consecutive pages of one TIFF file.
+    fout : string
+        The output TIFF filename, or Zarr chunk (see `write_image`). Any
+        existing file is overwritten.
+    compression_level : int [0-9], optional
+        The zlib compression level for writing the TIFF file.
+    backend : {'bioformats', 'native'}, optional
+        The reader used for the input file. See `read_image`.
+    tiff_options : dict, optional
+        Extra keyword arguments for `tifffile.imsave`. See `write_image`.
+    """
+    reader = lambda fn: read_image(fn, backend=backend)
+    if not read_into_tiff(fin, fout, reader, compression_level, tiff_options):
+        write_image(fout, read_images(fin, reader=reader), compression_level,
+                    tiff_options)
+
+
+def read_into_tiff(fin, fout, reader, compression_level=1, tiff_options=None):
+    """Read a group of images straight into their place in a TIFF file.
+
+    Uncompressed, untiled TIFF files are laid out ahead of time, so the
+    images of a stack or montage can be read into a memory map of the output
+    file (see `tifffile.memmap`), instead of into an array in memory that
+    is then written out. The file is written under a temporary name, and
+    renamed once complete.
+
+    Parameters
+    ----------
+    fin : string or tuple
+        The input filename, or a group of filenames. See `read_images`.
+    fout : string
+        The output filename.
+    reader : callable
+        A function reading a single filename.
+    compression_level : int [0-9], optional
+        The zlib compression level.
+    tiff_options : dict, optional
+        Extra keyword arguments for `tifffile.imsave`. See `write_image`.
+
+    Returns
+    -------
+    done : bool
+        False, without reading anything, if `fin` is a single file, or if
+        the output is not an uncompressed, untiled TIFF file, in which case
+        `write_image` should be used.
+    """
+    options = dict(tiff_options or {})
+    if (not isinstance(fin, tuple) or compression_level or
+            is_zarr_chunk(fout) or options.get('tile') or
+            options.get('pyramid')):
+        return False
+    partial = fout + '.partial'
+    allocate = lambda shape, dtype: tif.memmap(
+        partial, shape, dtype, photometric='minisblack', **options)
+    try:
+        image = read_images(fin, reader=reader, allocate=allocate)
+        image.flush()
+        del image
+        os.rename(partial, fout)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return True
+
+
+def write_image(fout, image, compression_level=1, tiff_options=None):
+    """Write an image to a TIFF file, or to a chunk of a Zarr store.
+
+    The image is written to a temporary file and renamed, so that a failed
+    or killed conversion never leaves a truncated file that `pending`
+    would then skip.
+
+    Parameters
+    ----------
+    fout : string
+        The output filename. Filenames in a directory ending in ``.zarr``
+        are chunks of a `ZarrPlate`; any other filename is a TIFF file.
+    image : numpy ndarray
+        The image.
+    compression_level : int [0-9], optional
+        The zlib compression level.
+    tiff_options : dict, optional
+        Extra keyword arguments for `tifffile.imsave`, such as ``tile``,
+        used when writing a TIFF file.
+    """
+    if is_zarr_chunk(fout):
+        write_zarr_chunk(fout, image, compression_level)
+        return
+    partial = fout + '.partial'
+    try:
+        tif.imsave(partial, image, compress=compression_level,
+                   photometric='minisblack', **(tiff_options or {}))
+        os.rename(partial, fout)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+
+def encode_image(fout, image, compression_level=1, tiff_options=None):
+    """Return the bytes that `write_image` would write to `fout`."""
+    if is_zarr_chunk(fout):
+        return encode_zarr_chunk(image, compression_level)
+    buf = io.BytesIO()
+    tif.imsave(buf, image, compress=compression_level,
+               photometric='minisblack', **(tiff_options or {}))
+    return buf.getvalue()
+
+
+class Converter(object):
+    """Convert Cellomics images, owning the JVM used to read them.
+
+    By default, the JVM runs in a worker subprocess, started on first use.
+    Unlike the JVM of the current process (see `start` and `done`), the
+    worker can be restarted at any time, so a converter can be kept warm
+    in a long-running service or notebook and recycled as needed, e.g.
+    to release memory, without making the process unable to convert.
+
+    Parameters
+    ----------
+    compression_level : int [0-9], optional
+        The zlib compression level for writing TIFF files.
+    backend : {'bioformats', 'native'}, optional
+        The reader used for the input files. See `read_image`.
+    max_heap_size : string, optional
+        The maximum heap size of the JVM. See `start`. It may be changed
+        between requests, and takes effect when the worker is restarted.
+    isolate : bool, optional
+        If True (default), run the JVM in a worker subprocess. If False,
+        use the JVM of the current process, which cannot be restarted.
+    cache_size : int, optional
+        The number of Bio-Formats readers kept open, so that repeated
+        reads of the same file do not have to reopen it.
+    max_tasks : int, optional
+        If given, restart the worker after this many requests.
+    timeout : float, optional
+        If given, the number of seconds an isolated worker may take over a
+        request (including starting the JVM, on its first Bio-Formats
+        read). A worker that takes longer is killed, and replaced on the
+        next request.
+    tiff_options : dict, optional
+        Extra keyword arguments for `tifffile.imsave`. See `write_image`.
+
+    Examples
+    --------
+    >>> fin = 'tests/cellomics_files/image1.c01'
+    >>> with Converter(backend='native') as converter:
+    ...     converter.read(fin).shape
+    ...     converter.restart()
+    ...     converter.read(fin).shape
+    (512, 512)
+    (512, 512)
+    """
+    def __init__(self, compression_level=1, backend='bioformats',
+                 max_heap_size=None, isolate=True, cache_size=4,
+                 max_tasks=None, timeout=None, tiff_options=None):
+        if backend not in BACKENDS:
+            raise ValueError("Unknown backend %r. Valid backends are: %s"
+                             % (backend, ', '.join(BACKENDS)))
+        self.compression_level = compression_level
+        self.backend = backend
+        self.max_heap_size = max_heap_size
+        self.isolate = isolate
+        self.cache_size = cache_size
+        self.max_tasks = max_tasks
+        self.timeout = timeout
+        self.tiff_options = tiff_options
+        self._readers = collections.OrderedDict()
+        self._process = None
+        self._conn = None
+        self._tasks = 0
+
+    def _settings(self):
+        return dict(compression_level=self.compression_level,
+                    backend=self.backend, max_heap_size=self.max_heap_size,
+                    cache_size=self.cache_size,
+                    tiff_options=self.tiff_options)
+
+    def read(self, sources):
+        """Read an image, or a group of images, as an array.
+
+        Parameters
+        ----------
+        sources : string or tuple
+            A filename, or a group of filenames. See `read_images`.
+
+        Returns
+        -------
+        image : numpy ndarray
+            The image.
+        """
+        if self.isolate:
+            return self._call('read', sources)
+        return read_images(sources, reader=self._read_image)
+
+    def convert(self, fin, fout):
+        """Convert an image, or a group of images, to a TIFF file.
+
+        Parameters
+        ----------
+        fin : string or tuple
+            The input filename, or a group of filenames. See `read_images`.
+        fout : string
+            The output TIFF filename. Any existing file is overwritten.
+        """
+        if self.isolate:
+            return self._call('convert', fin, fout)
+        if not read_into_tiff(fin, fout, self._read_image,
+                              self.compression_level, self.tiff_options):
+            write_image(fout, self.read(fin), self.compression_level,
+                        self.tiff_options)
+
+    def heap_usage(self, collect=False):
+        """Return the fraction of the JVM heap in use. See `heap_usage`.
+
+        For isolated converters, this is the heap of the worker's JVM, and
+        None is returned if the worker is not running.
+        """
+        if not self.isolate:
+            return heap_usage(collect)
+        if self._process is None:
+            return None
+        status, value = self._request('heap_usage', collect)
+        if status == 'error':
+            raise value
+        return value
+
+    def _read_image(self, source):
+        """Read a single image, reusing open Bio-Formats readers."""
+        if self.backend == 'native':
+            try:
+                return read_cellomics(source)
+            except ValueError:
+                pass  # unrecognized variant: let Bio-Formats handle it
+        _check_vm(self.max_heap_size)
+        rdr = self._readers.pop(source, None)
+        if rdr is None:
+            rdr = bf.ImageReader(source)
+        try:
+            image = rdr.read(rescale=False)
+        except Exception:
+            rdr.close()
+            raise
+        self._readers[source] = rdr
+        while len(self._readers) > self.cache_size:
+            self._readers.popitem(last=False)[1].close()
+        return image
+
+    def _call(self, method, *args):
+        """Run a task in the worker subprocess, starting it if needed."""
+        if self._process is None:
+            self._start_worker()
+        status, value = self._request(method, *args)
+        self._tasks += 1
+        if self.max_tasks is not None and self._tasks >= self.max_tasks:
+            self.restart()
+        if status == 'error':
+            raise value
+        return value
+
+    def _request(self, method, *args):
+        """Send a request to the running worker and return its reply."""
+        try:
+            self._conn.send((method, args))
+            if self.timeout is not None and not self._conn.poll(self.timeout):
+                self._stop_worker(timeout=0)
+                raise RuntimeError("The converter worker process timed out "
+                                   "after %gs." % self.timeout)
+            return self._conn.recv()
+        except (EOFError, IOError, OSError):
+            self._stop_worker()
+            raise RuntimeError("The converter worker process died.")
+
+    def _start_worker(self):
+        context = mp.get_context('spawn') if hasattr(mp, 'get_context') \
+            else mp
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(target=_converter_worker,
+                                        args=(child_conn, self._settings()))
+        self._process.daemon = True
+        self._process.start()
+        child_conn.close()
+        self._tasks = 0
+
+    def _stop_worker(self, timeout=10):
+        if self._process is None:
+            return
+        try:
+            self._conn.send(None)
+        except (IOError, OSError):
+            pass  # the worker is already gone
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join(10)
+        if self._process.is_alive() and hasattr(self._process, 'kill'):
+            self._process.kill()  # a hung JVM may ignore SIGTERM
+            self._process.join()
+        self._conn.close()
+        self._process = self._conn = None
+
+    def restart(self):
+        """Restart the worker subprocess, and with it the JVM.
+
+        The new worker is started on the next request. For converters that
+        are not isolated, only the cached readers are released, since the
+        JVM of the current process cannot be restarted.
+        """
+        if self.isolate:
+            self._stop_worker()
+        self._close_readers()
+
+    def _close_readers(self):
+        while self._readers:
+            self._readers.popitem()[1].close()
+
+    def close(self):
+        """Shut down the worker subprocess, if any, and release readers."""
+        self.restart()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _converter_worker(conn, settings):
+    """Serve `Converter` requests from a parent process over `conn`."""
+    converter = Converter(isolate=False, **settings)
+    try:
+        while True:
+            try:
+                request = conn.recv()
+            except EOFError:
+                break
+            if request is None:
+                break
+            method, args = request
+            try:
+                result = getattr(converter, method)(*args)
+            except Exception as e:
+                try:
+                    conn.send(('error', e))
+                except Exception:  # exception could not be pickled
+                    conn.send(('error', RuntimeError(
+                        '%s: %s' % (type(e).__name__, e))))
+            else:
+                conn.send(('ok', result))
+    finally:
+        converter.close()
+        if VM_STARTED and not VM_KILLED:
+            done()
+
+
+def read_images(sources, backend='bioformats', reader=None, allocate=None):
+    """Read one image, or stack several images into one array.
+
+    Parameters
+    ----------
+    sources : string or tuple
+        A filename, or a tuple of filenames of images with the same shape
+        and type, as produced by `stack_channels`, or a tuple of grids of
+        filenames, as produced by `montage_wells`.
+    backend : {'bioformats', 'native'}, optional
+        The reader used for the input files. See `read_image`.
+    reader : callable, optional
+        A function reading a single filename, used instead of `read_image`.
+    allocate : callable, optional
+        A function returning an array of zeros for a stack or montage,
+        given its shape and dtype, e.g. a memory map of the output file.
+
+    Returns
+    -------
+    image : numpy ndarray
+        The image, or the images stacked along a new first axis, or the
+        montage of each grid stacked along a new first axis.
+    """
+    if reader is None:
+        reader = lambda fn: read_image(fn, backend=backend)
+    if not isinstance(sources, tuple):
+        return reader(sources)
+    if isinstance(sources[0], tuple):
+        return read_montage(sources, reader=reader, allocate=allocate)
+    first = reader(sources[0])
+    stack = (allocate or np.zeros)((len(sources),) + first.shape, first.dtype)
+    stack[0] = first
+    for i, source in enumerate(sources[1:], 1):
+        stack[i] = reader(source)
+    return stack
+
+
+def read_montage(channels, backend='bioformats', reader=None, allocate=None):
+    """Read grids of images into a single preallocated montage array.
+
+    Parameters
+    ----------
+    channels : tuple of tuple of tuple of string
+        For each channel, a grid (a tuple of rows) of filenames of images
+        with the same shape and type. Missing images are given as None,
+        and are left as zeros in the montage.
+    backend : {'bioformats', 'native'}, optional
+        The reader used for the input files. See `read_image`.
+    reader : callable, optional
+        A function reading a single filename, used instead of `read_image`.
+    allocate : callable, optional
+        A function returning an array of zeros for the montage, given its
+        shape and dtype. See `read_images`.
+
+    Returns
+    -------
+    montage : numpy ndarray, shape (n_channels, n_rows * M, n_cols * N)
+        The montage of each channel, where (M, N) is the image shape.
+    """
+    if reader is None:
+        reader = lambda fn: read_image(fn, backend=backend)
+    montage = None
+    for c, grid in enumerate(channels):
+        for i, row in enumerate(grid):
+            for j, source in enumerate(row):
+                if source is None:
+                    continue
+                image = reader(source)
+                if montage is None:
+                    h, w = image.shape[:2]
+                    montage = (allocate or np.zeros)(
+                        (len(channels), len(grid) * h, len(row) * w) +
+                        image.shape[2:], image.dtype)
+                montage[c, i*h:(i+1)*h, j*w:(j+1)*w] = image
+    return montage
+
+
+def grid_shape(n, grid=None):
+    """Return the (rows, columns) of a grid that fits `n` fields.
+
+    Parameters
+    ----------
+    n : int
+        The number of fields.
+    grid : (int, int), optional
+        The grid given by the user. If None, the most nearly square grid,
+        with at least as many columns as rows, is used.
+
+    Returns
+    -------
+    rows, cols : int
+        The grid shape.
+
+    Examples
+    --------
+    >>> grid_shape(6), grid_shape(9), grid_shape(10)
+    ((2, 3), (3, 3), (3, 4))
+    """
+    if grid is not None:
+        rows, cols = grid
+        if rows * cols < n:
+            raise ValueError("%i fields do not fit in a %ix%i grid"
+                             % (n, rows, cols))
+        return rows, cols
+    cols = int(np.ceil(np.sqrt(n)))
+    rows = int(np.ceil(n / cols))
+    return rows, cols
+
+
+def montage_wells(work, grid=None, stack=False):
+    """Group the fields of each well into a single montage work item.
+
+    The fields of each well (and channel, unless `stack` is True) are
+    laid out row by row on a grid, each field at the grid index given by
+    its field number, so that missing fields leave gaps (None) rather than
+    shifting the later fields. The output filename
+    drops the field, e.g. ``MFGTMP_120628160001_C18d1.tif``, or, when
+    stacking channels, also the channel, e.g. ``MFGTMP_120628160001_C18.tif``.
+    Files whose names do not follow the Cellomics scheme are passed
+    through unchanged.
+
+    Only the items of one output directory are held in memory at a time,
+    so the work should be grouped by output directory, as produced by
+    `iter_work`.
+
+    Parameters
+    ----------
+    work : iterable of (string, string) tuples
+        Input and output filenames.
+    grid : (int, int), optional
+        The number of rows and columns of the montage. By default, it is
+        inferred from the number of fields in each well (see `grid_shape`).
+    stack : bool, optional
+        If True, also stack the channels of each well, as in
+        `stack_channels`.
+
+    Yields
+    ------
+    sources, fout : tuple, string
+        For each channel, the grid of input filenames (see `read_montage`),
+        and the output filename.
+
+    Examples
+    --------
+    >>> work = [('in/P_A01f%02id0.C01' % i, 'out/P_A01f%02id0.tif' % i)
+    ...         for i in range(3)]
+    >>> for item in montage_wells(work):
+    ...     print(item)  # doctest: +NORMALIZE_WHITESPACE
+    (((('in/P_A01f00d0.C01', 'in/P_A01f01d0.C01'),
+       ('in/P_A01f02d0.C01', None)),), 'out/P_A01d0.tif')
+    >>> for item in montage_wells(work[::2]):
+    ...     print(item)  # doctest: +NORMALIZE_WHITESPACE
+    (((('in/P_A01f00d0.C01', None),
+       ('in/P_A01f02d0.C01', None)),), 'out/P_A01d0.tif')
+    """
+    def key(plate, well, field, channel):
+        if stack:
+            return '%s_%s' % (plate, well), (channel, field)
+        return '%s_%s%s' % (plate, well, channel), (channel, field)
+
+    def arrange(members):
+        channels = collections.OrderedDict()
+        for (channel, field), fin in members:
+            channels.setdefault(channel, {})[int(field)] = fin
+        n = max(max(fields) for fields in channels.values()) + 1
+        rows, cols = grid_shape(n, grid)
+        result = []
+        for fields in channels.values():
+            fields = [fields.get(i) for i in range(rows * cols)]
+            result.append(tuple(tuple(fields[i*cols:(i+1)*cols])
+                                for i in range(rows)))
+        return tuple(result)
+
+    return _group_work(work, key, arrange)
+
+
+def stack_channels(work):
+    """Group the channels of each well and field into a single work item.
+
+    Cellomics filenames encode the plate, well, field and channel, e.g.
+    ``MFGTMP_120628160001_C18f03d1.C01`` is channel ``d1`` of field ``03``
+    of well ``C18``. The channels (including any ``o1`` mask) of each
+    field are grouped, in channel order, and given the output filename
+    without the channel, e.g. ``MFGTMP_120628160001_C18f03.tif``. Files
+    whose names do not follow this scheme are passed through unchanged.
+
+    Only the items of one output directory are held in memory at a time,
+    so the work should be grouped by output directory, as produced by
+    `iter_work`.
+
+    Parameters
+    ----------
+    work : iterable of (string, string) tuples
+        Input and output filenames.
+
+    Yields
+    ------
+    sources, fout : tuple of string, string
+        The input filenames of each field, and the output filename.
+
+    Examples
+    --------
+    >>> work = [('in/P_A01f00d1.C01', 'out/P_A01f00d1.tif'),
+    ...         ('in/P_A01f00d0.C01', 'out/P_A01f00d0.tif'),
+    ...         ('in/P_A01f01d0.C01', 'out/P_A01f01d0.tif')]
+    >>> for item in stack_channels(work):
+    ...     print(item)
+    (('in/P_A01f00d0.C01', 'in/P_A01f00d1.C01'), 'out/P_A01f00.tif')
+    (('in/P_A01f01d0.C01',), 'out/P_A01f01.tif')
+    """
+    return _group_work(work, lambda plate, well, field, channel:
+                       ('%s_%sf%s' % (plate, well, field), channel))
+
+
+def _group_work(work, key, arrange=None):
+    """Group consecutive work items in each output directory.
+
+    `key` maps the parsed Cellomics filename of each input to the output
+    filename (without extension) of its group, and the sort key of the
+    input within the group. `arrange`, if given, maps the sorted list of
+    (sort key, filename) pairs of a group to its sources; by default, the
+    sources are the tuple of filenames.
+    """
+    out_base = None
+    groups = collections.OrderedDict()
+
+    def flush():
+        for name, members in groups.items():
+            members.sort()
+            if arrange is None:
+                sources = tuple(fin for _, fin in members)
+            else:
+                sources = arrange(members)
+            yield sources, os.path.join(out_base, name + '.tif')
+        groups.clear()
+
+    for fin, fout in work:
+        head = os.path.dirname(fout)
+        if head != out_base:
+            for item in flush():
+                yield item
+            out_base = head
+        fields = parse_cellomics_name(fin)
+        if fields is None:
+            yield fin, fout
+            continue
+        name, order = key(*fields)
+        groups.setdefault(name, []).append((order, fin))
+    for item in flush():
+        yield item
+
+
+def convert_serial(work, compression_level=1, backend='bioformats',
+                   verbose=False, manifest=None, max_heap_size=None,
+                   tiff_options=None):
+    """Convert files one at a time in the current process.
+
+    Parameters
+    ----------
+    work : iterable of (string, string) tuples
+        Input and output filenames, as produced by `iter_work`,
+        `stack_channels` or `montage_wells`.
+    compression_level : int [0-9], optional
+        The zlib compression level for writing the TIFF files.
+    backend : {'bioformats', 'native'}, optional
+        The reader used for the input files. See `read_image`.
+    verbose : bool, optional
+        If ``True``, print out each input file before converting it.
+    manifest : `Manifest`, optional
+        If given, record the outcome of each conversion in it.
+    max_heap_size : string, optional
+        The maximum heap size of the JVM, if it is started. See `start`.
+    tiff_options : dict, optional
+        Extra keyword arguments for `tifffile.imsave`. See `write_image`.
+    """
+    converter = Converter(compression_level, backend, max_heap_size,
+                          isolate=False, cache_size=0,
+                          tiff_options=tiff_options)
+    for fin, fout in work:
         if verbose:
             print(fin)
-        fout = os.path.join(out_base, fn)[:-4] + '.tif'
-        if not os.path.exists(fout):
-            im = read_image(fin)
-            tif.imsave(fout, im, compress=compression_level)
-        else:
+        start_time = time.time()
+        try:
+            converter.convert(fin, fout)
+        except Exception as e:
+            if manifest is not None:
+                manifest.record(fin, fout, 'failed', time.time() - start_time,
+                                '%s: %s' % (type(e).__name__, e))
+            raise
+        if manifest is not None:
+            manifest.record(fin, fout, 'done', time.time() - start_time)
+
+
+def convert_pipelined(work, compression_level=1, backend='bioformats',
+                      queue_size=4, verbose=False, manifest=None,
+                      max_heap_size=None, tiff_options=None):
+    """Convert files, overlapping reading, compression and writing.
+
+    Images are read in the calling thread, which owns the JVM. They are
+    encoded to TIFF (including zlib compression) on a second thread, and
+    written to disk on a third. Both zlib and file writes release the GIL,
+    so all three stages run concurrently. The queues between stages hold
+    at most `queue_size` items each, which bounds memory use.
+
+    Parameters
+    ----------
+    work : iterable of (string, string) tuples
+        Input and output filenames, as produced by `iter_work`,
+        `stack_channels` or `montage_wells`.
+    compression_level : int [0-9], optional
+        The zlib compression level for writing the TIFF files.
+    backend : {'bioformats', 'native'}, optional
+        The reader used for the input files. See `read_image`.
+    queue_size : int, optional
+        The maximum number of images (decoded or encoded) waiting between
+        each pair of stages.
+    verbose : bool, optional
+        If ``True``, print out each input file as it is read.
+    manifest : `Manifest`, optional
+        If given, record each completed conversion in it.
+    max_heap_size : string, optional
+        The maximum heap size of the JVM, if it is started. See `start`.
+    tiff_options : dict, optional
+        Extra keyword arguments for `tifffile.imsave`. See `write_image`.
+
+    Returns
+    -------
+    busy : dict of {string: float}
+        The time in seconds that each stage ('read', 'encode', 'write')
+        spent working, and the total elapsed time ('total').
+    """
+    busy = {'read': 0., 'encode': 0., 'write': 0.}
+    errors = []
+    converter = Converter(compression_level, backend, max_heap_size,
+                          isolate=False, cache_size=0,
+                          tiff_options=tiff_options)
+    encode_queue = queue.Queue(queue_size)
+    write_queue = queue.Queue(queue_size)
+
+    def encode():
+        while True:
+            item = encode_queue.get()
+            if item is None:
+                write_queue.put(None)
+                return
+            if errors:
+                continue  # drain the queue so that the reader never blocks
+            fin, fout, image, seconds = item
+            start_time = time.time()
+            try:
+                encoded = encode_image(fout, image, compression_level,
+                                       tiff_options)
+            except Exception as e:
+                errors.append(e)
+                continue
+            elapsed = time.time() - start_time
+            busy['encode'] += elapsed
+            write_queue.put((fin, fout, encoded, seconds + elapsed))
+
+    def write():
+        while True:
+            item = write_queue.get()
+            if item is None:
+                return
+            if errors:
+                continue
+            fin, fout, encoded, seconds = item
+            start_time = time.time()
+            partial = fout + '.partial'
+            try:
+                with open(partial, 'wb') as fh:
+                    fh.write(encoded)
+                os.rename(partial, fout)
+            except Exception as e:
+                errors.append(e)
+                continue
+            elapsed = time.time() - start_time
+            busy['write'] += elapsed
+            if manifest is not None:
+                manifest.record(fin, fout, 'done', seconds + elapsed)
+
+    threads = [threading.Thread(target=encode), threading.Thread(target=write)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    total_time = time.time()
+    try:
+        for fin, fout in work:
+            if errors:
+                break
             if verbose:
-                print(fout, "exists")
+                print(fin)
+            start_time = time.time()
+            image = converter.read(fin)
+            elapsed = time.time() - start_time
+            busy['read'] += elapsed
+            encode_queue.put((fin, fout, image, elapsed))
+    finally:
+        encode_queue.put(None)
+        for thread in threads:
+            thread.join()
+    busy['total'] = time.time() - total_time
+    if errors:
+        raise errors[0]
+    return busy
+
+
+def print_busy(busy, fout=sys.stdout):
+    """Print the busy time of each stage of `convert_pipelined`."""
+    total = max(busy['total'], 1e-9)
+    for stage in ('read', 'encode', 'write'):
+        fout.write('%s: %.2fs busy (%.0f%%)\n'
+                   % (stage, busy[stage], 100 * busy[stage] / total))
+    fout.write('total: %.2fs\n' % busy['total'])
+
+
+def convert_parallel(work, jobs, compression_level=1, backend='bioformats',
+                     verbose=False, manifest=None, max_heap_size=None,
+                     heap_limit=0.85, timeout=None, error_file=None,
+                     writer=None, tiff_options=None):
+    """Convert files using several worker processes.
+
+    Each worker is a `Converter`, running its own JVM in a subprocess, and
+    is driven by a thread of the current process. A worker that crashes,
+    or that takes longer than `timeout` over a file, is replaced, and the
+    conversion continues with the next file. Unless `max_heap_size`
+    is given, the heap of each JVM is sized from the memory available at
+    the start, the number of workers, and the sizes of the first source
+    files (see `auto_heap_size`).
+
+    The heap usage of each JVM is sampled after every conversion. When it
+    exceeds `heap_limit`, even after garbage collection, that worker is
+    retired, so that fewer JVMs compete for memory, and the remaining
+    workers are restarted with a larger share of it before they run out.
+    The last worker is restarted instead of being retired.
+
+    Parameters
+    ----------
+    work : iterable of (string, string) tuples
+        Input and output filenames, as produced by `iter_work`,
+        `stack_channels` or `montage_wells`.
+    jobs : int
+        The number of worker processes.
+    compression_level : int [0-9], optional
+        The zlib compression level for writing the TIFF files.
+    backend : {'bioformats', 'native'}, optional
+        The reader used for the input files. See `read_image`.
+    verbose : bool, optional
+        If ``True``, print out each conversion as it completes.
+    manifest : `Manifest`, optional
+        If given, record the outcome of each conversion in it.
+    max_heap_size : string, optional
+        The maximum heap size of each JVM. See `start`.
+    heap_limit : float, optional
+        The fraction of its heap that a JVM may use before the number of
+        workers is reduced.
+    timeout : float, optional
+        The maximum time in seconds to spend on each file.
+    error_file : file, optional
+        If given, each failed input filename is written to it, with the
+        reason, as soon as the failure happens.
+    writer : callable, optional
+        If given, the workers only read the images, and ``writer(fin, fout,
+        image)`` is called in the current process to write each of them,
+        e.g. to a file that only one process may write to. It is called
+        from several threads at once.
+    tiff_options : dict, optional
+        Extra keyword arguments for `tifffile.imsave`. See `write_image`.
+
+    Returns
+    -------
+    failures : list of (string, string) tuples
+        The input filenames that could not be converted, and the error
+        raised by each.
+    """
+    work = iter(work)
+    sample = list(itertools.islice(work, 4 * jobs))
+    work = itertools.chain(sample, work)
+    source_size = max([_source_size(fin) for fin, _ in sample] or [0])
+    auto = max_heap_size is None
+    # measured before any JVM starts, since they take available memory
+    budget = heap_budget() if auto else None
+    state = {'workers': jobs, 'stop': False,
+             'heap': auto_heap_size(jobs, source_size, budget=budget) if auto
+             else max_heap_size}
+    lock = threading.Lock()
+    results = queue.Queue()
+
+    def under_pressure(converter):
+        usage = converter.heap_usage()
+        if usage is not None and usage > heap_limit:
+            usage = converter.heap_usage(collect=True)
+        return usage is not None and usage > heap_limit
+
+    def run():
+        converter = Converter(compression_level, backend, state['heap'],
+                              timeout=timeout, tiff_options=tiff_options)
+        try:
+            while True:
+                with lock:
+                    if state['stop']:
+                        return
+                    item = next(work, None)
+                    heap = state['heap']
+                if item is None:
+                    return
+                if converter.max_heap_size != heap:
+                    converter.max_heap_size = heap
+                    converter.restart()
+                fin, fout = item
+                start_time = time.time()
+                try:
+                    if writer is None:
+                        converter.convert(fin, fout)
+                    else:
+                        writer(fin, fout, converter.read(fin))
+                except Exception as e:
+                    error = '%s: %s' % (type(e).__name__, e)
+                else:
+                    error = None
+                results.put((fin, fout, time.time() - start_time, error))
+                if not under_pressure(converter):
+                    continue
+                with lock:
+                    retire = state['workers'] > 1
+                    if retire:
+                        state['workers'] -= 1
+                        if auto:
+                            state['heap'] = auto_heap_size(
+                                state['workers'], source_size, budget=budget)
+                if retire:
+                    print('JVM heap above %.0f%%: reducing to %i workers'
+                          % (100 * heap_limit, state['workers']),
+                          file=sys.stderr)
+                    return
+                converter.restart()
+        except BaseException as e:
+            results.put(e)
+        finally:
+            converter.close()
+            results.put(None)
+
+    threads = [threading.Thread(target=run) for _ in range(jobs)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    failures = []
+    running = len(threads)
+    count = 0
+    try:
+        while running:
+            result = results.get()
+            if result is None:
+                running -= 1
+                continue
+            if isinstance(result, BaseException):
+                raise result
+            fin, fout, seconds, error = result
+            count += 1
+            if manifest is not None:
+                manifest.record(fin, fout, 'failed' if error else 'done',
+                                seconds, error)
+            if error is not None:
+                failures.append((fin, error))
+                print('%s failed: %s' % (fin, error), file=sys.stderr)
+                if error_file is not None:
+                    error_file.write('%s\t%s\n'
+                                     % (','.join(_sources(fin)), error))
+                    error_file.flush()
+            elif verbose:
+                print('[%i] %s -> %s' % (count, fin, fout))
+    finally:
+        with lock:
+            state['stop'] = True
+        for thread in threads:
+            thread.join()
+    return failures
+
+
+def _source_size(fin):
+    """Return the total size in bytes of the sources of a work item."""
+    return sum(os.path.getsize(source) for source in _sources(fin))
+
+
+def iter_work(root_path, out_path, ignore_masks=False, make_dirs=True,
+              stats=None):
+    """Lazily pair Cellomics images in a directory tree with output files.
+
+    The tree is traversed with `os.scandir`, and (input, output) pairs are
+    yielded as soon as they are found, so conversion can begin before the
+    whole tree has been listed. All the files of a directory are yielded
+    before any of its subdirectories are visited. The output directory
+    structure mirrors the input tree, and is created as it is traversed.
+
+    Parameters
+    ----------
+    root_path : string
+        The top of the directory tree containing Cellomics files.
+    out_path : string
+        The directory under which to place converted files.
+    ignore_masks : bool, optional
+        Ignore files ending in "o1.C01".
+    make_dirs : bool, optional
+        Create the output directories. Set to False if the output filenames
+        will be replaced, e.g. by `zarr_work`.
+    stats : dict, optional
+        If given, the size and modification time of each input file are
+        stored in it by filename before the file is yielded, for
+        `Manifest.pending`. They are taken from the directory listing, with
+        `DirEntry.stat`, which needs no further system call on Windows, but
+        one per file on POSIX.
+
+    Yields
+    ------
+    fin, fout : string
+        The input filename and the corresponding output TIFF filename.
+
+    Examples
+    --------
+    >>> work = iter_work('tests/cellomics_files', 'tests/all_tiff_files')
+    >>> sorted(work)  # doctest: +NORMALIZE_WHITESPACE
+    [('tests/cellomics_files/image1.c01', 'tests/all_tiff_files/image1.tif'),
+     ('tests/cellomics_files/image2.c01', 'tests/all_tiff_files/image2.tif')]
+    >>> shutil.rmtree('tests/all_tiff_files') # cleanup after doctest
+    """
+    stack = [(root_path, out_path)]
+    while stack:
+        path, out_base = stack.pop()
+        if make_dirs and not os.path.isdir(out_base):
+            os.makedirs(out_base)
+        subdirs = []
+        for entry in scandir(path):
+            name = entry.name
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append((entry.path, os.path.join(out_base, name)))
+            elif is_cellomics_image(name) and not (
+                    ignore_masks and is_cellomics_mask(name)):
+                if stats is not None:
+                    st = entry.stat()
+                    stats[entry.path] = (st.st_size, st.st_mtime)
+                yield entry.path, os.path.join(out_base, name)[:-4] + '.tif'
+        stack.extend(reversed(subdirs))
+
+
+def pending(work, verbose=False):
+    """Filter out work items whose output file already exists.
+
+    Rather than checking each output file individually, each output
+    directory is listed once, when the first item destined for it is seen.
+    Only the listing of the current directory is kept in memory, so the
+    work should be grouped by output directory, as produced by `iter_work`.
+
+    Parameters
+    ----------
+    work : iterable of (string, string) tuples
+        Input and output filenames.
+    verbose : bool, optional
+        If ``True``, print out the output files that already exist.
+
+    Yields
+    ------
+    fin, fout : string
+        The work items whose output file does not exist.
+    """
+    out_base, existing = None, set()
+    for fin, fout in work:
+        head, tail = os.path.split(fout)
+        if head != out_base:
+            out_base = head
+            existing = set(os.listdir(head)) if os.path.isdir(head) else set()
+        if tail not in existing:
+            yield fin, fout
+        elif verbose:
+            print(fout, "exists")
+
+
+def _parse_grid(arg):
+    """Parse a 'ROWSxCOLS' command line argument."""
+    if arg == 'auto':
+        return arg
+    try:
+        rows, cols = (int(n) for n in arg.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid grid %r, expected e.g. "
+                                         "'2x3' or 'auto'" % arg)
+    return rows, cols
 
 
 def main():
@@ -192,18 +1418,171 @@ def main():
                         default=1,
                         help="Compression level for TIFF files.")
     parser.add_argument('-E', '--error-file', metavar='FILENAME',
-                        help='Log problem filenames to the given filename.')
+                        help='Log problem filenames, and the reason they '
+                        'failed, to the given filename, and carry on with '
+                        'the remaining files.')
     parser.add_argument('-m', '--ignore-masks', action='store_true',
                         help='Ignore files ending in "o1.C01".')
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='Print out runtime information.')
+    parser.add_argument('-b', '--backend', choices=BACKENDS,
+                        default='bioformats',
+                        help='Image reader: "native" decodes Cellomics '
+                        'files without the JVM, falling back on Bio-Formats '
+                        'for unrecognized files.')
+    parser.add_argument('-j', '--jobs', metavar='INT', type=int, default=1,
+                        help='Number of worker processes. Each worker runs '
+                        'its own JVM, and workers are retired if their JVM '
+                        'heap fills up.')
+    parser.add_argument('--max-heap', metavar='SIZE',
+                        help='Maximum heap size of each JVM, e.g. "4G". By '
+                        'default, it is sized from the available memory, '
+                        'the number of jobs and the size of the input files.')
+    parser.add_argument('-t', '--timeout', metavar='SECONDS', type=float,
+                        help='Give up on any file that takes longer than '
+                        'this to convert, replacing its worker process.')
+    parser.add_argument('-f', '--format', choices=OUTPUTS, default='tiff',
+                        help='Output format: a TIFF file per image, or a '
+                        'chunked array per plate, with dimensions (well, '
+                        'field, channel, y, x), in a Zarr store, '
+                        'out_path/PLATE.zarr, or in an HDF5 file, '
+                        'out_path/PLATE.h5 (requires h5py).')
+    parser.add_argument('-M', '--manifest', action='store_true',
+                        help='Record conversions in a database in out_path, '
+                        'and use it to skip converted files on reruns. '
+                        'Files whose source has changed are reconverted.')
+    parser.add_argument('-p', '--pipeline', action='store_true',
+                        help='Overlap reading, compression and writing of '
+                        'consecutive files on separate threads, and report '
+                        'how busy each stage was. Used only with one job.')
+    parser.add_argument('-s', '--stack-channels', action='store_true',
+                        help='Write all channels (and masks, unless -m is '
+                        'given) of each well and field to a single '
+                        'multi-page TIFF.')
+    parser.add_argument('--montage', metavar='ROWSxCOLS', type=_parse_grid,
+                        help='Stitch the fields of each well (and channel, '
+                        'unless -s is given) into a single montage, on a '
+                        'grid of this shape, or, given "auto", on a grid '
+                        'inferred from the number of fields.')
+    parser.add_argument('--tile', metavar='INT', type=int,
+                        help='Write TIFF planes as square tiles of this '
+                        'size (a multiple of 16), each compressed on its '
+                        'own, so that regions can be read without '
+                        'decompressing whole planes. Montages are tiled '
+                        '256x256 unless this is given; 0 writes strips.')
+    parser.add_argument('--rows-per-strip', metavar='INT', type=int,
+                        help='Write untiled TIFF planes in strips of this '
+                        'many rows, each compressed on its own, instead of '
+                        'one strip per plane.')
+    parser.add_argument('--predictor', action='store_true',
+                        help='Compress the differences between neighbouring '
+                        'pixels of TIFF images, which gives smaller files '
+                        'for smooth images, even at low compression levels.')
+    parser.add_argument('--pyramid', metavar='INT', type=int, default=0,
+                        help='Also write this many reduced-resolution '
+                        'levels of each TIFF plane, each half the size of '
+                        'the previous one, for fast overviews.')
+    parser.add_argument('--threads', metavar='INT', type=int, default=1,
+                        help='Number of threads compressing the strips or '
+                        'tiles of each TIFF file, e.g. of stacks (-s) and '
+                        'montages, in each job.')
 
     args = parser.parse_args()
-    paths = os.walk(args.root_path)
-    for path, dirs, files in paths:
-        convert_files(path.replace(args.root_path, args.out_path, 1), path,
-                      files, args.compression, args.ignore_masks, args.verbose)
-    done()
+    tiff = args.format == 'tiff'
+    if not tiff and (args.stack_channels or args.montage is not None):
+        parser.error('-s and --montage can only be used with --format tiff')
+    tiff_options = {}
+    if args.tile is not None:
+        if not tiff:
+            parser.error('--tile can only be used with --format tiff')
+        if args.tile > 0:
+            tiff_options['tile'] = (args.tile, args.tile)
+    elif args.montage is not None:
+        tiff_options['tile'] = (256, 256)
+    if args.rows_per_strip is not None:
+        if not tiff or 'tile' in tiff_options:
+            parser.error('--rows-per-strip can only be used with --format '
+                         'tiff, and not with tiles')
+        tiff_options['rowsperstrip'] = args.rows_per_strip
+    if args.pyramid:
+        if not tiff:
+            parser.error('--pyramid can only be used with --format tiff')
+        tiff_options['pyramid'] = args.pyramid
+    if args.predictor:
+        if not tiff or args.compression == 0:
+            parser.error('--predictor can only be used with --format tiff '
+                         'and compression')
+        tiff_options['predictor'] = True
+    if args.threads > 1:
+        if not tiff:
+            parser.error('--threads can only be used with --format tiff')
+        tiff_options['maxworkers'] = args.threads
+    if args.verbose and hasattr(tif, 'accelerators'):
+        print('tifffile decoders: ' + ', '.join(
+            '%s %s' % item for item in sorted(tif.accelerators().items())))
+    # collected for manifest.pending, which HDF5 output does not use
+    stats = {} if args.manifest and args.format != 'hdf5' else None
+    work = iter_work(args.root_path, args.out_path, args.ignore_masks,
+                     make_dirs=tiff, stats=stats)
+    plates = {}
+    writer = None
+    if args.format == 'zarr':
+        work = zarr_work(work, args.out_path, plates, args.compression,
+                         reader=lambda fn: read_image(fn, args.backend))
+    elif args.format == 'hdf5':
+        if not os.path.isdir(args.out_path):
+            os.makedirs(args.out_path)
+        work = hdf5_work(work, args.out_path, plates, args.compression,
+                         args.verbose)
+        writer = lambda fin, fout, image: write_hdf5(plates, fin, image)
+    elif args.montage is not None:
+        grid = None if args.montage == 'auto' else args.montage
+        work = montage_wells(work, grid, stack=args.stack_channels)
+    elif args.stack_channels:
+        work = stack_channels(work)
+    manifest = None
+    if args.manifest:
+        if not os.path.isdir(args.out_path):
+            os.makedirs(args.out_path)
+        manifest = Manifest(os.path.join(args.out_path, MANIFEST_NAME))
+        if writer is None:
+            work = manifest.pending(work, args.verbose, stats)
+    elif writer is None:
+        work = pending(work, args.verbose)
+    error_file = None
+    try:
+        if (args.jobs > 1 or args.timeout is not None or
+                args.error_file is not None or writer is not None):
+            # supervised workers: one bad file cannot stop the batch
+            if args.error_file is not None:
+                error_file = open(args.error_file, 'a')
+            failures = convert_parallel(work, args.jobs, args.compression,
+                                        args.backend, args.verbose, manifest,
+                                        args.max_heap, timeout=args.timeout,
+                                        error_file=error_file, writer=writer,
+                                        tiff_options=tiff_options)
+            if failures:
+                print('%i files failed to convert' % len(failures),
+                      file=sys.stderr)
+        elif args.pipeline:
+            busy = convert_pipelined(work, args.compression, args.backend,
+                                     verbose=args.verbose, manifest=manifest,
+                                     max_heap_size=args.max_heap,
+                                     tiff_options=tiff_options)
+            print_busy(busy)
+        else:
+            convert_serial(work, args.compression, args.backend,
+                           args.verbose, manifest, args.max_heap,
+                           tiff_options)
+    finally:
+        if manifest is not None:
+            manifest.close()
+        if error_file is not None:
+            error_file.close()
+        for plate in plates.values():
+            plate.close()
+    if VM_STARTED:
+        done()
 
 
 if __name__ == '__main__':
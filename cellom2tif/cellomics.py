@@ -0,0 +1,133 @@
+from __future__ import division, absolute_import, print_function
+
+import zlib
+import struct
+
+import numpy as np
+
+from .filetypes import has_extension
+
+
+# Cellomics images are Windows device-independent bitmaps (DIB): a 40-byte
+# BITMAPINFOHEADER followed by 12 further bytes, then the raw pixel data.
+# .C01 files are the same DIB, zlib-compressed after a 4-byte prefix.
+HEADER_SIZE = 52
+C01_PREFIX_SIZE = 4
+_HEADER = struct.Struct('<IiiHHI')
+
+
+def parse_header(buf, check_size=True):
+    """Parse the header of a decompressed Cellomics DIB.
+
+    Parameters
+    ----------
+    buf : bytes
+        The decompressed file contents (at least the first 52 bytes).
+    check_size : bool, optional
+        Check that `buf` contains all the pixel data given by the header.
+
+    Returns
+    -------
+    width, height, nplanes, nbits : int
+        The image width and height in pixels, the number of image
+        planes, and the number of bits per pixel.
+
+    Raises
+    ------
+    ValueError
+        If the header is not one that the native reader understands.
+    """
+    if len(buf) < HEADER_SIZE:
+        raise ValueError("file too short for a Cellomics header")
+    info_size, width, height, nplanes, nbits, _ = _HEADER.unpack_from(buf)
+    if info_size != 40:
+        raise ValueError("unknown DIB header size %i" % info_size)
+    if width <= 0 or height <= 0:
+        raise ValueError("unsupported image size %ix%i" % (width, height))
+    if nplanes != 1:
+        raise ValueError("unsupported number of planes %i" % nplanes)
+    if nbits not in (8, 16, 32):
+        raise ValueError("unsupported bit depth %i" % nbits)
+    if check_size and (len(buf) <
+                       HEADER_SIZE + width * height * nplanes * (nbits // 8)):
+        raise ValueError("compressed pixel data is not supported")
+    return width, height, nplanes, nbits
+
+
+def read_cellomics(filename):
+    """Read a Cellomics .C01 or .DIB image without Bio-Formats.
+
+    Parameters
+    ----------
+    filename : string
+        The path to a .C01 or .DIB file.
+
+    Returns
+    -------
+    image : numpy ndarray, 2 dimensions
+        The image, with the same shape and unsigned integer type that
+        Bio-Formats returns with ``rescale=False``.
+
+    Raises
+    ------
+    ValueError
+        If the file is a variant that this reader does not recognize. In
+        that case, the file should be read with Bio-Formats instead.
+
+    Examples
+    --------
+    >>> im = read_cellomics('tests/cellomics_files/image1.c01')
+    >>> im.shape, im.dtype
+    ((512, 512), dtype('uint16'))
+    """
+    with open(filename, 'rb') as fin:
+        buf = fin.read()
+    if has_extension(filename, 'C01'):
+        try:
+            buf = zlib.decompress(buf[C01_PREFIX_SIZE:])
+        except zlib.error as e:
+            raise ValueError("could not decompress %s: %s" % (filename, e))
+    width, height, _, nbits = parse_header(buf)
+    dtype = np.dtype('<u%i' % (nbits // 8))
+    image = np.frombuffer(buf, dtype=dtype, count=width * height,
+                          offset=HEADER_SIZE).reshape((height, width))
+    return image.astype(dtype.newbyteorder('='))
+
+
+def read_header(filename):
+    """Read the shape and type of a Cellomics image, but not its pixels.
+
+    Only the start of the file is read, and, for .C01 files, decompressed.
+
+    Parameters
+    ----------
+    filename : string
+        The path to a .C01 or .DIB file.
+
+    Returns
+    -------
+    shape : (int, int)
+        The image shape.
+    dtype : numpy dtype
+        The image type, as returned by `read_cellomics`.
+
+    Raises
+    ------
+    ValueError
+        If the file is a variant that `read_cellomics` does not recognize.
+
+    Examples
+    --------
+    >>> read_header('tests/cellomics_files/image1.c01')
+    ((512, 512), dtype('uint16'))
+    """
+    with open(filename, 'rb') as fin:
+        buf = fin.read(C01_PREFIX_SIZE + 4096)
+    if has_extension(filename, 'C01'):
+        try:
+            buf = zlib.decompressobj().decompress(buf[C01_PREFIX_SIZE:],
+                                                  HEADER_SIZE)
+        except zlib.error as e:
+            raise ValueError("could not decompress %s: %s" % (filename, e))
+    width, height, _, nbits = parse_header(buf, check_size=False)
+    return (height, width), np.dtype('u%i' % (nbits // 8))
@@ -1,4 +1,5 @@
 import os
+import re
 
 
 def has_extension(filename, ext):
@@ -67,3 +68,36 @@ def is_cellomics_mask(fn):
     base_fn = os.path.splitext(fn)[0]
     is_mask = base_fn.endswith('o1') or base_fn.endswith('o1')
     return is_mask
+
+
+_CELLOMICS_NAME = re.compile(r'^(?P<plate>.+)_(?P<well>[A-Za-z]+\d+)'
+                             r'f(?P<field>\d+)(?P<channel>[dDoO]\d+)$')
+
+
+def parse_cellomics_name(fn):
+    """Split a Cellomics filename into plate, well, field and channel.
+
+    Parameters
+    ----------
+    fn : string
+        The filename (with or without directory and extension).
+
+    Returns
+    -------
+    fields : tuple of string, or None
+        The plate, well, field and channel identifiers, or None if the
+        filename does not follow the Cellomics naming scheme. Mask images
+        have channels starting with "o".
+
+    Examples
+    --------
+    >>> parse_cellomics_name('MFGTMP_120628160001_C18f03d1.C01')
+    ('MFGTMP_120628160001', 'C18', '03', 'd1')
+    >>> parse_cellomics_name('image1.c01') is None
+    True
+    """
+    base_fn = os.path.splitext(os.path.basename(fn))[0]
+    match = _CELLOMICS_NAME.match(base_fn)
+    if match is None:
+        return None
+    return match.group('plate', 'well', 'field', 'channel')
@@ -0,0 +1,208 @@
+from __future__ import division, absolute_import, print_function
+
+import os
+import time
+import sqlite3
+import threading
+
+
+MANIFEST_NAME = '.cellom2tif-manifest.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversions (
+    source TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    output TEXT,
+    status TEXT,
+    seconds REAL,
+    timestamp REAL,
+    error TEXT
+)
+"""
+
+
+class Manifest(object):
+    """A persistent record of conversions, stored in an SQLite database.
+
+    For each source file, the manifest records its size and modification
+    time when it was converted, the output filename, the status of the
+    conversion ('done' or 'failed'), how long it took, and the error
+    message, if any. On a rerun, the files still to be converted can then
+    be found with a single query, instead of checking for each output file.
+
+    A manifest may be used from several threads of one process, for
+    example when `pending` is consumed by a process pool's task thread.
+
+    Parameters
+    ----------
+    filename : string
+        The database filename. It is created if it does not exist.
+    commit_every : int, optional
+        Commit recorded conversions to disk after this many records.
+
+    Examples
+    --------
+    >>> manifest = Manifest(':memory:')
+    >>> fin = 'tests/cellomics_files/image1.c01'
+    >>> list(manifest.pending([(fin, 'image1.tif')]))
+    [('tests/cellomics_files/image1.c01', 'image1.tif')]
+    >>> manifest.record(fin, 'image1.tif', 'done', seconds=0.1)
+    >>> list(manifest.pending([(fin, 'image1.tif')]))
+    []
+    >>> manifest.close()
+    """
+    def __init__(self, filename, commit_every=100):
+        self.filename = filename
+        self.commit_every = commit_every
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute(_SCHEMA)
+        self._db.commit()
+        self._uncommitted = 0
+        self._stats = {}
+
+    def pending(self, work, verbose=False, stats=None):
+        """Filter out work items that the manifest records as done.
+
+        An item is pending if its source has no successful conversion
+        recorded, or if the source size or modification time has changed
+        since it was converted, or if its output filename has changed.
+        Sources not in the manifest at all, but whose output file exists,
+        are assumed to have been converted before the manifest was used,
+        and are recorded as done without being converted again. As in
+        `cellom2tif.pending`, each output directory is listed once, when
+        the first such source destined for it is seen, rather than checking
+        each output file.
+
+        An item with several inputs, as produced by `stack_channels` or
+        `montage_wells`, is pending if any of its sources is.
+
+        Parameters
+        ----------
+        work : iterable of (string, string) tuples
+            Input and output filenames.
+        verbose : bool, optional
+            If ``True``, print out the output files that are up to date.
+        stats : dict, optional
+            The (size, modification time) of sources, by filename, as
+            collected by `iter_work` from its directory listing. Sources
+            found in it are not stat'ed by this method, and are removed
+            from it.
+
+        Yields
+        ------
+        fin, fout : string
+            The work items still to be converted.
+        """
+        done = {}
+        known = set()
+        query = 'SELECT source, size, mtime, output, status FROM conversions'
+        with self._lock:
+            records = self._db.execute(query).fetchall()
+        for source, size, mtime, output, status in records:
+            known.add(source)
+            if status == 'done':
+                done[source] = (size, mtime, output)
+        out_base, existing = None, set()
+        for fin, fout in work:
+            sources = _sources(fin)
+            found = {}
+            for source in sources:
+                if stats is not None and source in stats:
+                    found[source] = stats.pop(source)
+                else:
+                    st = os.stat(source)
+                    found[source] = (st.st_size, st.st_mtime)
+            if all(done.get(source) == found[source] + (fout,)
+                   for source in sources):
+                if verbose:
+                    print(fout, "up to date")
+                continue
+            self._stats.update(found)
+            if known.intersection(sources):
+                yield fin, fout
+                continue
+            head, tail = os.path.split(fout)
+            if head != out_base:
+                out_base = head
+                try:
+                    existing = set(os.listdir(head or os.curdir))
+                except OSError:
+                    existing = set()
+            if tail in existing:
+                self.record(fin, fout, 'done')
+                if verbose:
+                    print(fout, "exists")
+                continue
+            yield fin, fout
+
+    def record(self, fin, fout, status, seconds=None, error=None):
+        """Record the outcome of converting a file.
+
+        Parameters
+        ----------
+        fin : string or tuple of string
+            The input filename(s).
+        fout : string
+            The output filename.
+        status : {'done', 'failed'}
+            Whether the conversion succeeded.
+        seconds : float, optional
+            The time taken by the conversion.
+        error : string, optional
+            The error message, if the conversion failed.
+        """
+        rows = []
+        for source in _sources(fin):
+            if source in self._stats:
+                size, mtime = self._stats.pop(source)
+            else:
+                st = os.stat(source)
+                size, mtime = st.st_size, st.st_mtime
+            rows.append((source, size, mtime, fout, status, seconds,
+                         time.time(), error))
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO conversions VALUES '
+                                 '(?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every:
+                self._db.commit()
+                self._uncommitted = 0
+
+    def commit(self):
+        """Write recorded conversions to disk."""
+        with self._lock:
+            self._db.commit()
+            self._uncommitted = 0
+
+    def summary(self):
+        """Return the number of recorded conversions by status.
+
+        Returns
+        -------
+        counts : dict of {string: int}
+            The number of sources with each status.
+        """
+        query = 'SELECT status, COUNT(*) FROM conversions GROUP BY status'
+        with self._lock:
+            return dict(self._db.execute(query))
+
+    def close(self):
+        """Commit any recorded conversions and close the database."""
+        self.commit()
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _sources(fin):
+    """Return the input filenames of a (possibly nested) work item."""
+    if not isinstance(fin, tuple):
+        return (fin,) if fin is not None else ()
+    return tuple(source for item in fin for source in _sources(item))
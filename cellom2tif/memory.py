@@ -0,0 +1,109 @@
+from __future__ import division, absolute_import, print_function
+
+import os
+import warnings
+
+
+MB = 2**20
+
+# The JVM needs a baseline heap for Bio-Formats itself, plus room for a
+# few copies of the decompressed image of each file being read.
+JVM_BASE_HEAP = 256 * MB
+JVM_HEAP_PER_SOURCE_BYTE = 32
+# A conversion holds only a few copies of one image at a time, so a heap
+# beyond 8G would only lengthen garbage collection pauses and take memory
+# from the other workers and the page cache. Larger files may exceed it.
+MAX_HEAP = 8 * 2**10 * MB
+
+
+def system_memory():
+    """Return the total and available physical memory, in bytes.
+
+    `psutil` is used if it is installed. Otherwise, ``/proc/meminfo`` is
+    read on Linux, and on other systems the available memory is assumed
+    to be the total memory.
+
+    Returns
+    -------
+    total, available : int
+        The total and available memory in bytes.
+    """
+    try:
+        import psutil
+    except ImportError:
+        pass
+    else:
+        mem = psutil.virtual_memory()
+        return mem.total, mem.available
+    try:
+        meminfo = {}
+        with open('/proc/meminfo') as fin:
+            for line in fin:
+                name, value = line.split(':', 1)
+                meminfo[name] = int(value.split()[0]) * 1024
+        return meminfo['MemTotal'], meminfo.get('MemAvailable',
+                                                meminfo['MemFree'])
+    except (IOError, OSError, KeyError, ValueError):
+        pass
+    total = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    return total, total
+
+
+def format_heap_size(nbytes):
+    """Format a number of bytes as a JVM heap size string.
+
+    Examples
+    --------
+    >>> format_heap_size(3 * 2**30)
+    '3072M'
+    """
+    return '%iM' % max(nbytes // MB, 1)
+
+
+def heap_budget(fraction=0.75):
+    """Return the memory, in bytes, that all JVMs may share.
+
+    This is `fraction` of the memory available now, so it should be
+    computed before any JVM is started.
+    """
+    _, available = system_memory()
+    return int(available * fraction)
+
+
+def auto_heap_size(workers=1, source_size=0, fraction=0.75, budget=None):
+    """Choose a JVM heap size from memory, workers and file sizes.
+
+    Each worker gets an equal share of `budget`, capped at `MAX_HEAP`. A
+    warning is raised if the share is less than the heap that files of
+    `source_size` bytes are estimated to need, in which case fewer workers
+    should be used.
+
+    Parameters
+    ----------
+    workers : int, optional
+        The number of JVMs that will run concurrently.
+    source_size : int, optional
+        The size in bytes of the largest source file to be read.
+    fraction : float, optional
+        The fraction of available memory to share between the JVMs, if
+        `budget` is not given.
+    budget : int, optional
+        The memory in bytes to share between the JVMs, from `heap_budget`.
+        Give it when JVMs are already running, since they reduce the
+        available memory.
+
+    Returns
+    -------
+    max_heap_size : string
+        The heap size, e.g. '2048M', for `start`.
+    """
+    if budget is None:
+        budget = heap_budget(fraction)
+    share = budget // max(workers, 1)
+    needed = JVM_BASE_HEAP + JVM_HEAP_PER_SOURCE_BYTE * source_size
+    if share < needed:
+        warnings.warn("%i workers get %s of heap each, but files of %i "
+                      "bytes need about %s; consider using fewer workers"
+                      % (workers, format_heap_size(share), source_size,
+                         format_heap_size(needed)))
+    return format_heap_size(min(share, max(needed, MAX_HEAP)))
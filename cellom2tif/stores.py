@@ -0,0 +1,564 @@
+from __future__ import division, absolute_import, print_function
+
+import os
+import sys
+import json
+import zlib
+import threading
+
+import numpy as np
+
+from .cellomics import read_header
+from .filetypes import parse_cellomics_name
+
+
+DIMENSIONS = ('well', 'field', 'channel', 'y', 'x')
+
+
+def is_zarr_chunk(fout):
+    """Return True if `fout` is a chunk of a Zarr array, by its directory.
+
+    Examples
+    --------
+    >>> is_zarr_chunk('out/MFGTMP_120628160001.zarr/0.0.1.0.0')
+    True
+    >>> is_zarr_chunk('out/MFGTMP_120628160001_C18f00d0.tif')
+    False
+    """
+    return os.path.dirname(fout).endswith('.zarr')
+
+
+def encode_zarr_chunk(image, compression_level=1):
+    """Return the bytes of a Zarr chunk holding `image`.
+
+    Parameters
+    ----------
+    image : numpy ndarray
+        The image, which fills the chunk.
+    compression_level : int [0-9], optional
+        The zlib compression level. 0 writes the raw pixels.
+
+    Returns
+    -------
+    data : bytes
+        The little-endian, C-ordered pixels, compressed with zlib.
+    """
+    data = np.ascontiguousarray(image, image.dtype.newbyteorder('<'))
+    data = data.tobytes()
+    if compression_level:
+        data = zlib.compress(data, compression_level)
+    return data
+
+
+def write_zarr_chunk(fout, image, compression_level=1):
+    """Write `image` as one chunk of a Zarr array.
+
+    The chunk is written to a temporary file and renamed, so that readers,
+    and reruns of an interrupted conversion, never see a partial chunk.
+    Chunks are independent files, so any number of processes can write
+    chunks of the same array concurrently.
+
+    Parameters
+    ----------
+    fout : string
+        The chunk filename, as produced by `ZarrPlate.chunk`.
+    image : numpy ndarray
+        The image.
+    compression_level : int [0-9], optional
+        The zlib compression level. It must match that of the array.
+    """
+    partial = fout + '.partial'
+    with open(partial, 'wb') as fh:
+        fh.write(encode_zarr_chunk(image, compression_level))
+    os.rename(partial, fout)
+
+
+def _write_json(filename, obj):
+    partial = filename + '.partial'
+    with open(partial, 'w') as fout:
+        json.dump(obj, fout, indent=4, sort_keys=True)
+    os.rename(partial, filename)
+
+
+class _Plate(object):
+    """Assign the well, field and channel labels of a plate to indices."""
+    def _set_labels(self, labels):
+        self.labels = labels
+        self._index = dict((dim, dict((label, i) for i, label
+                                      in enumerate(labels[dim])))
+                           for dim in DIMENSIONS[:3])
+
+    def position(self, well, field, channel):
+        """Return the (well, field, channel) indices of an image.
+
+        Labels not seen before are given the next index of their dimension.
+
+        Returns
+        -------
+        position : tuple of int
+            The indices of the image.
+        new : bool
+            Whether any of the labels is new.
+        """
+        position = []
+        new = False
+        for dim, label in zip(DIMENSIONS, (well, field, channel)):
+            index = self._index[dim]
+            if label not in index:
+                index[label] = len(self.labels[dim])
+                self.labels[dim].append(label)
+                new = True
+            position.append(index[label])
+        return tuple(position), new
+
+    def sort_labels(self):
+        """Sort the labels of each dimension, so that the layout of a plate
+        does not depend on the order in which its files were found.
+
+        Returns
+        -------
+        remap : function or None
+            Maps the old (well, field, channel) indices of an image to its
+            new ones. None if the labels were already sorted.
+        """
+        order = dict((dim, sorted(self.labels[dim]))
+                     for dim in DIMENSIONS[:3])
+        if all(order[dim] == self.labels[dim] for dim in order):
+            return None
+        new = dict((dim, [order[dim].index(label)
+                          for label in self.labels[dim]])
+                   for dim in order)
+        self._set_labels(order)
+        return lambda position: tuple(new[dim][i] for dim, i
+                                      in zip(DIMENSIONS, position))
+
+    def _shape(self):
+        """Return the array shape covering all labels seen."""
+        return tuple(max(len(self.labels[dim]), 1)
+                     for dim in DIMENSIONS[:3]) + tuple(self.shape)
+
+
+class ZarrPlate(_Plate):
+    """A plate of images, stored as a Zarr (version 2) directory store.
+
+    The array has dimensions (well, field, channel, y, x), with one chunk
+    per image, so that any image, or any block of images, can be read with
+    Zarr (or any other Zarr reader) without listing or opening the other
+    chunks. The well, field and channel labels of each index, e.g.
+    ``'C18'``, ``'03'`` and ``'d1'``, are stored in the array attributes,
+    and are kept when the conversion of a plate is resumed.
+
+    The store is written without Zarr itself: the chunks by
+    `write_zarr_chunk`, possibly from many processes, and the metadata by
+    this class, in the process that assigns the chunks. New labels are
+    given the next index of their dimension as they are found, and sorted
+    by `close`.
+
+    Parameters
+    ----------
+    path : string
+        The directory of the store, conventionally ending in ``.zarr``.
+    compression_level : int [0-9], optional
+        The zlib compression level of the chunks. 0 stores raw pixels.
+    """
+    def __init__(self, path, compression_level=1):
+        self.path = path
+        self.compression_level = compression_level
+        self.shape = None
+        self.dtype = None
+        labels = dict((dim, []) for dim in DIMENSIONS[:3])
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        zattrs = os.path.join(path, '.zattrs')
+        if os.path.exists(zattrs):
+            with open(zattrs) as fin:
+                attrs = json.load(fin)
+            for dim in labels:
+                labels[dim] = attrs[dim + 's']
+        self._set_labels(labels)
+        zarray = os.path.join(path, '.zarray')
+        if os.path.exists(zarray):
+            with open(zarray) as fin:
+                meta = json.load(fin)
+            if (meta['compressor'] is None) != (compression_level == 0):
+                raise ValueError("%s was written with a different "
+                                 "compressor" % path)
+            self.shape = tuple(meta['chunks'][3:])
+            self.dtype = np.dtype(meta['dtype'])
+
+    def set_image(self, shape, dtype):
+        """Set the shape and type of the images, if not already known."""
+        if self.shape is None:
+            self.shape = tuple(shape)
+            self.dtype = np.dtype(dtype)
+            self.write_metadata()
+
+    def chunk(self, well, field, channel):
+        """Return the chunk filename of an image, indexing new labels.
+
+        Parameters
+        ----------
+        well, field, channel : string
+            The labels of the image, as given by `parse_cellomics_name`.
+
+        Returns
+        -------
+        fout : string
+            The filename to which the image should be written.
+        """
+        position, new = self.position(well, field, channel)
+        if new:
+            self.write_metadata()
+        return os.path.join(self.path,
+                            '.'.join(map(str, position + (0, 0))))
+
+    def write_metadata(self):
+        """Write the array metadata and labels to the store."""
+        _write_json(os.path.join(self.path, '.zattrs'), {
+            '_ARRAY_DIMENSIONS': list(DIMENSIONS),
+            'wells': self.labels['well'], 'fields': self.labels['field'],
+            'channels': self.labels['channel']})
+        if self.shape is None:
+            return
+        compressor = None
+        if self.compression_level:
+            compressor = {'id': 'zlib', 'level': self.compression_level}
+        _write_json(os.path.join(self.path, '.zarray'), {
+            'zarr_format': 2,
+            'shape': list(self._shape()),
+            'chunks': [1, 1, 1] + list(self.shape),
+            'dtype': self.dtype.newbyteorder('<').str,
+            'compressor': compressor, 'fill_value': 0, 'order': 'C',
+            'filters': None})
+
+    def close(self):
+        """Sort the labels of the store, renaming its chunks to match.
+
+        Call once all the chunks have been written. A store left unsorted,
+        e.g. by an interrupted conversion, remains valid, and is sorted
+        when it is next closed.
+        """
+        remap = self.sort_labels()
+        if remap is None:
+            return
+        moves = []
+        for name in os.listdir(self.path):
+            if name.endswith('.sorting'):
+                # left by an interrupted close; the chunk is written again
+                os.remove(os.path.join(self.path, name))
+                continue
+            parts = name.split('.')
+            if len(parts) != 5 or not all(part.isdigit() for part in parts):
+                continue
+            position = tuple(int(part) for part in parts[:3])
+            new = remap(position)
+            if new != position:
+                moves.append((name, '.'.join(map(str, new + (0, 0)))))
+        for name, _ in moves:
+            os.rename(os.path.join(self.path, name),
+                      os.path.join(self.path, name + '.sorting'))
+        for name, new in moves:
+            os.rename(os.path.join(self.path, name + '.sorting'),
+                      os.path.join(self.path, new))
+        self.write_metadata()
+
+
+def zarr_work(work, out_path, plates, compression_level=1, reader=None):
+    """Direct each image into the Zarr store of its plate.
+
+    Each plate is stored in ``out_path/<plate>.zarr``, whatever the
+    subdirectory of its files (see `ZarrPlate`). The image shape and type
+    of each plate are taken from the header of its first file. Files whose
+    names do not follow the Cellomics scheme are skipped.
+
+    The work is consumed as it is yielded. The well, field and channel
+    labels of each plate are indexed in the order they are found, and
+    sorted when its store is closed (see `ZarrPlate.close`).
+
+    Parameters
+    ----------
+    work : iterable of (string, string) tuples
+        Input and output filenames, as produced by `iter_work`. The output
+        filenames are ignored.
+    out_path : string
+        The directory in which to place the plate stores.
+    plates : dict of {string: `ZarrPlate`}
+        The stores of each plate, filled in as plates are found. The
+        caller should close them once the images have been written.
+    compression_level : int [0-9], optional
+        The zlib compression level of new stores.
+    reader : callable, optional
+        A function reading a whole image, used to find the shape and type
+        of images whose header is not recognized (see `read_header`).
+
+    Yields
+    ------
+    fin, fout : string
+        The input filename and the chunk filename of the image.
+    """
+    for fin, _ in work:
+        fields = parse_cellomics_name(fin)
+        if fields is None:
+            print('%s skipped: not a Cellomics well image' % fin,
+                  file=sys.stderr)
+            continue
+        plate, well, field, channel = fields
+        store = plates.get(plate)
+        if store is None:
+            store = plates[plate] = ZarrPlate(
+                os.path.join(out_path, plate + '.zarr'), compression_level)
+        if store.shape is None:
+            try:
+                shape, dtype = read_header(fin)
+            except ValueError:
+                if reader is None:
+                    raise
+                image = reader(fin)
+                shape, dtype = image.shape, image.dtype
+            store.set_image(shape, dtype)
+        yield fin, store.chunk(well, field, channel)
+
+
+class HDF5Plate(_Plate):
+    """A plate of images, stored in a single HDF5 file (requires h5py).
+
+    The images are stored in the ``images`` dataset, with dimensions
+    (well, field, channel, y, x), one compressed chunk per image, and the
+    well, field and channel labels of each index as attributes. The
+    ``index`` dataset has a row per image written, giving its source
+    filename, labels and position in ``images``.
+
+    HDF5 files cannot be written by several processes, so images are
+    written by the process that owns the plate, e.g. as they are returned
+    by reading workers. `write` may be called from several threads: the
+    images are compressed concurrently, and written one at a time. New
+    labels are given the next index of their dimension as images arrive,
+    and sorted by `close`.
+
+    Parameters
+    ----------
+    path : string
+        The HDF5 filename, conventionally ending in ``.h5``. An existing
+        plate file is appended to.
+    compression_level : int [0-9], optional
+        The gzip (zlib) compression level of the images. 0 stores raw
+        pixels.
+    """
+    def __init__(self, path, compression_level=1):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("HDF5 output requires h5py")
+        self.path = path
+        self.compression_level = compression_level
+        self._lock = threading.Lock()
+        self._file = h5py.File(path, 'a')
+        self.written = set()
+        labels = dict((dim, []) for dim in DIMENSIONS[:3])
+        self.shape = self.dtype = None
+        if 'index' in self._file:
+            for row in self._file['index'][:]:
+                self.written.add(tuple(_decode(row[dim])
+                                       for dim in DIMENSIONS[:3]))
+        else:
+            dtype = np.dtype([('source', h5py.special_dtype(vlen=str))] +
+                             [(dim, h5py.special_dtype(vlen=str))
+                              for dim in DIMENSIONS[:3]] +
+                             [(dim + '_index', np.int32)
+                              for dim in DIMENSIONS[:3]])
+            self._file.create_dataset('index', (0,), dtype, maxshape=(None,),
+                                      chunks=(1024,))
+        if 'images' in self._file:
+            images = self._file['images']
+            self.shape = images.shape[3:]
+            self.dtype = images.dtype
+            for dim in labels:
+                labels[dim] = [_decode(label)
+                               for label in images.attrs.get(dim + 's', [])]
+        self._set_labels(labels)
+
+    def __contains__(self, labels):
+        """Whether the image with (well, field, channel) labels is written."""
+        return tuple(labels) in self.written
+
+    def write(self, source, well, field, channel, image):
+        """Write an image, and its row of the index.
+
+        Parameters
+        ----------
+        source : string
+            The filename the image was read from.
+        well, field, channel : string
+            The labels of the image, as given by `parse_cellomics_name`.
+        image : numpy ndarray
+            The image.
+        """
+        chunk = None
+        if self.compression_level:
+            # an HDF5 gzip chunk is a zlib stream, like a Zarr chunk
+            chunk = encode_zarr_chunk(image, self.compression_level)
+        with self._lock:
+            if self.shape is None:
+                self.shape, self.dtype = image.shape, image.dtype
+                self._create_images()
+            if (image.shape != tuple(self.shape) or
+                    image.dtype.newbyteorder('<') != self.dtype):
+                raise ValueError("%s is a %s %s image, but the images of %s "
+                                 "are %s %s" % (source, image.shape,
+                                                image.dtype, self.path,
+                                                self.shape, self.dtype))
+            position, _ = self.position(well, field, channel)
+            images = self._file['images']
+            if images.shape != self._shape():
+                images.resize(self._shape())
+                for dim in DIMENSIONS[:3]:
+                    images.attrs[dim + 's'] = [label.encode('utf-8') for
+                                               label in self.labels[dim]]
+            if chunk is None:
+                images[position] = image
+            else:
+                images.id.write_direct_chunk(position + (0, 0), chunk)
+            index = self._file['index']
+            n = len(index)
+            index.resize((n + 1,))
+            index[n] = (source, well, field, channel) + position
+            self.written.add((well, field, channel))
+
+    def _create_images(self):
+        options = {}
+        if self.compression_level:
+            options = dict(compression='gzip',
+                           compression_opts=self.compression_level)
+        self.dtype = np.dtype(self.dtype).newbyteorder('<')
+        self._file.create_dataset(
+            'images', (0, 0, 0) + tuple(self.shape), self.dtype,
+            maxshape=(None, None, None) + tuple(self.shape),
+            chunks=(1, 1, 1) + tuple(self.shape), fillvalue=0, **options)
+        self._file['images'].attrs['dimensions'] = [
+            dim.encode('utf-8') for dim in DIMENSIONS]
+
+    def flush(self):
+        """Write buffered data to disk."""
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        """Sort the labels of the plate, moving its images to match, and
+        close the HDF5 file.
+
+        The images are moved as raw chunks, without decompressing them.
+        """
+        with self._lock:
+            remap = self.sort_labels()
+            if remap is not None and 'images' in self._file:
+                self._reorder(remap)
+            self._file.close()
+
+    def _reorder(self, remap):
+        images = self._file['images']
+        index = self._file['index']
+        rows = index[:]
+        columns = [dim + '_index' for dim in DIMENSIONS[:3]]
+        moves = {}
+        for row in rows:
+            position = tuple(int(row[column]) for column in columns)
+            moves[position] = remap(position)
+            for column, i in zip(columns, moves[position]):
+                row[column] = i
+        _move_chunks(images, moves)
+        for dim in DIMENSIONS[:3]:
+            images.attrs[dim + 's'] = [label.encode('utf-8') for
+                                       label in self.labels[dim]]
+        if len(rows):
+            index[:] = rows
+
+
+def _move_chunks(images, moves):
+    """Move the (well, field, channel) chunks of an HDF5 dataset from each
+    position in `moves` to its new position, holding one chunk at a time.
+
+    Positions left without an image are filled with zeros.
+    """
+    def move(source, dest, chunk=None):
+        if chunk is None:
+            chunk = images.id.read_direct_chunk(source + (0, 0))
+        images.id.write_direct_chunk(dest + (0, 0), chunk[1], chunk[0])
+
+    sources = dict((new, old) for old, new in moves.items())
+    # chains, starting from a position that held no image
+    for position in set(sources).difference(moves):
+        while position in sources:
+            source = sources.pop(position)
+            move(source, position)
+            position = source
+        images[position] = 0
+    # cycles, rotated through one held chunk
+    for start in list(sources):
+        if start not in sources or sources[start] == start:
+            continue
+        held = images.id.read_direct_chunk(start + (0, 0))
+        position = start
+        while sources[position] != start:
+            source = sources.pop(position)
+            move(source, position)
+            position = source
+        del sources[position]
+        move(None, position, held)
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def hdf5_work(work, out_path, plates, compression_level=1, verbose=False):
+    """Direct each image into the HDF5 file of its plate.
+
+    Each plate is stored in ``out_path/<plate>.h5``, whatever the
+    subdirectory of its files (see `HDF5Plate`). Images already in the
+    file are skipped, as are files whose names do not follow the Cellomics
+    scheme. As in `zarr_work`, the work is consumed as it is yielded, and
+    the labels of each plate are sorted when it is closed.
+
+    Parameters
+    ----------
+    work : iterable of (string, string) tuples
+        Input and output filenames, as produced by `iter_work`. The output
+        filenames are ignored.
+    out_path : string
+        The directory in which to place the plate files.
+    plates : dict of {string: `HDF5Plate`}
+        The open files of each plate, filled in as plates are found. The
+        caller should close them once the images have been written.
+    compression_level : int [0-9], optional
+        The zlib compression level of new files.
+    verbose : bool, optional
+        If ``True``, print out the images already in a plate file.
+
+    Yields
+    ------
+    fin, fout : string
+        The input filename and the HDF5 filename of its plate. Each image
+        should be written with `write_hdf5`.
+    """
+    for fin, _ in work:
+        fields = parse_cellomics_name(fin)
+        if fields is None:
+            print('%s skipped: not a Cellomics well image' % fin,
+                  file=sys.stderr)
+            continue
+        plate = fields[0]
+        if plate not in plates:
+            plates[plate] = HDF5Plate(os.path.join(out_path, plate + '.h5'),
+                                      compression_level)
+        if fields[1:] in plates[plate]:
+            if verbose:
+                print(fin, "already in", plates[plate].path)
+            continue
+        yield fin, plates[plate].path
+
+
+def write_hdf5(plates, fin, image):
+    """Write an image read from `fin` to its plate, as directed by
+    `hdf5_work`."""
+    plate, well, field, channel = parse_cellomics_name(fin)
+    plates[plate].write(fin, well, field, channel, image)
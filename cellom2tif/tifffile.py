@@ -158,7 +158,7 @@ except ImportError:
 
 __version__ = '0.3.3'
 __docformat__ = 'restructuredtext en'
-__all__ = ('imsave', 'imread', 'imshow', 'TiffFile', 'TiffWriter',
+__all__ = ('imsave', 'imread', 'imshow', 'memmap', 'TiffFile', 'TiffWriter',
            'TiffSequence')
 
 
@@ -169,8 +169,8 @@ def imsave(filename, data, **kwargs):
 
     Parameters
     ----------
-    filename : str
-        Name of file to write.
+    filename : str or open file
+        Name of file or binary file object to write.
     data : array_like
         Input image. The last dimensions are assumed to be image depth,
         height, width, and samples.
@@ -178,8 +178,9 @@ def imsave(filename, data, **kwargs):
         Parameters 'byteorder', 'bigtiff', and 'software' are passed to
         the TiffWriter class.
         Parameters 'photometric', 'planarconfig', 'resolution',
-        'description', 'compress', 'volume', and 'extratags' are passed to
-        the TiffWriter.save function.
+        'description', 'compress', 'volume', 'extratags', 'maxworkers',
+        'tile', 'rowsperstrip', 'pyramid', and 'predictor' are passed to the
+        TiffWriter.save function.
 
     Examples
     --------
@@ -204,6 +205,68 @@ def imsave(filename, data, **kwargs):
         tif.save(data, **kwargs)
 
 
+def memmap(filename, shape=None, dtype=None, page=None, series=0, mode='r+',
+           **kwargs):
+    """Return memory-mapped numpy array of image data stored in TIFF file.
+
+    If shape and dtype are given, a new file is created, with space for
+    uncompressed image data of that shape and type, initially zeros, so that
+    images can be written straight into their final place in the file.
+    Otherwise, the image data of a page or series in an existing file are
+    mapped, which requires them to be uncompressed, contiguous, and in
+    native byte order.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the TIFF file.
+    shape, dtype : tuple, numpy.dtype
+        The shape and type of the image data of a new file.
+    page, series : int
+        The page or (by default) series of an existing file to map.
+    mode : {'r+', 'r', 'c'}
+        The numpy.memmap mode.
+    kwargs : dict
+        Additional parameters for imsave, e.g. 'photometric', when a new
+        file is created.
+
+    Examples
+    --------
+    >>> im = memmap('temp.tif', shape=(256, 256), dtype='float32')
+    >>> im[255, 255] = 1.0
+    >>> im.flush()
+    >>> del im
+    >>> memmap('temp.tif', mode='r')[255, 255]
+    1.0
+
+    """
+    if shape is not None and dtype is not None:
+        kwargs.update(data=None, shape=shape, dtype=dtype, returnoffset=True)
+        tifargs = {}
+        for key in ('bigtiff', 'software'):
+            if key in kwargs:
+                tifargs[key] = kwargs.pop(key)
+        if ('bigtiff' not in tifargs and
+                product(shape) * numpy.dtype(dtype).itemsize > 2000*2**20):
+            tifargs['bigtiff'] = True
+        with TiffWriter(filename, **tifargs) as tif:
+            offset, _ = tif.save(**kwargs)
+        dtype = numpy.dtype(dtype).newbyteorder('=')
+    else:
+        with TiffFile(filename) as tif:
+            if page is not None:
+                pages = [tif.pages[page]]
+                shape = pages[0].shape
+            else:
+                pages = tif.series[series].pages
+                shape = tif.series[series].shape
+            offset = tif._memmap_offset(pages)
+            if offset is None:
+                raise ValueError("image data are not memory-mappable")
+            dtype = numpy.dtype(pages[0]._dtype)
+    return numpy.memmap(filename, dtype, mode, offset, shape, 'C')
+
+
 class TiffWriter(object):
     """Write image data to TIFF file.
 
@@ -230,7 +293,8 @@ class TiffWriter(object):
         'planar_configuration': 284, 'page_name': 285, 'resolution_unit': 296,
         'software': 305, 'datetime': 306, 'predictor': 317, 'color_map': 320,
         'tile_width': 322, 'tile_length': 323, 'tile_offsets': 324,
-        'tile_byte_counts': 325, 'extra_samples': 338, 'sample_format': 339,
+        'tile_byte_counts': 325, 'sub_ifds': 330, 'extra_samples': 338,
+        'sample_format': 339,
         'image_depth': 32997, 'tile_depth': 32998}
 
     def __init__(self, filename, bigtiff=False, byteorder=None,
@@ -241,8 +305,9 @@ class TiffWriter(object):
 
         Parameters
         ----------
-        filename : str
-            Name of file to write.
+        filename : str or open file
+            Name of file to write, or an open binary file object, e.g.
+            io.BytesIO, which is not closed by TiffWriter.close.
         bigtiff : bool
             If True, the BigTIFF format is used.
         byteorder : {'<', '>'}
@@ -260,8 +325,19 @@ class TiffWriter(object):
 
         self._byteorder = byteorder
         self._software = software
+        self._reduced = False
 
-        self._fh = open(filename, 'wb')
+        if hasattr(filename, 'write'):
+            self._fh = filename
+            self._close = False
+        else:
+            self._fh = open(filename, 'wb')
+            self._close = True
+        try:
+            self._fh.fileno()
+            self._tofile = True
+        except Exception:  # io.UnsupportedOperation
+            self._tofile = False
         self._fh.write({'<': b'II', '>': b'MM'}[byteorder])
 
         if bigtiff:
@@ -285,12 +361,17 @@ class TiffWriter(object):
         self._ifd_offset = self._fh.tell()
         self._fh.write(struct.pack(byteorder+self._offset_format, 0))
 
-    def save(self, data, photometric=None, planarconfig=None, resolution=None,
-             description=None, volume=False, writeshape=False, compress=0,
-             extratags=()):
+    def save(self, data=None, photometric=None, planarconfig=None,
+             resolution=None, description=None, volume=False,
+             writeshape=False, compress=0, extratags=(), maxworkers=None,
+             tile=None, rowsperstrip=None, pyramid=0, predictor=False,
+             shape=None, dtype=None, returnoffset=False):
         """Write image data to TIFF file.
 
-        Image data are written in one stripe per plane.
+        Image data are written in strips, by default one per plane, or in
+        tiles. Uncompressed data are laid out ahead of time: the IFDs of all
+        pages are written first, followed by the data of all pages in one
+        contiguous block, which can be memory-mapped (see memmap).
         Dimensions larger than 2 to 4 (depending on photometric mode, planar
         configuration, and SGI mode) are flattened and saved as separate pages.
         The 'sample_format' and 'bits_per_sample' TIFF tags are derived from
@@ -301,6 +382,9 @@ class TiffWriter(object):
         data : array_like
             Input image. The last dimensions are assumed to be image depth,
             height, width, and samples.
+            If None, the shape and dtype parameters are used to reserve
+            space for uncompressed, untiled image data of that shape and type
+            instead, which read as zeros until written, e.g. via memmap.
         photometric : {'minisblack', 'miniswhite', 'rgb'}
             The color space of the image data.
             By default this setting is inferred from the data shape.
@@ -338,6 +422,43 @@ class TiffWriter(object):
                 'Count' values compatible with 'dtype'.
             writeonce : bool
                 If True, the tag is written to the first page only.
+        maxworkers : int
+            Maximum number of threads used to compress strips or tiles.
+            If None or 1 (default), they are compressed sequentially.
+            Zlib releases the GIL, so compression of multi-strip, multi-tile
+            and multi-page data scales with the number of threads.
+        tile : tuple of int
+            The shape (length, width) of the tiles in which each plane is
+            written, or (depth, length, width) for volume data. Each tile is
+            compressed separately, so that regions of a plane can be read
+            without decompressing all of it. Tile length and width must be
+            multiples of 16. Tiles at the edges are padded with zeros.
+            If None (default), planes are written in strips, or, for
+            volume data, in one tile.
+        rowsperstrip : int
+            The number of rows in each strip, which is compressed
+            separately, so that rows of a plane can be read without
+            decompressing all of it. The last strip of a plane may be
+            shorter. If None (default), each plane is written in one strip.
+            Not valid for tiled data.
+        pyramid : int
+            Number of reduced-resolution images written for each page, in
+            the SubIFDs of the page, with the 'new_subfile_type' tag marking
+            them as reduced images. Each level is the previous one averaged
+            over blocks of 2x2 pixels (see block_average), and is written
+            with the same compression and tile shape. Not supported for
+            volume data.
+        predictor : bool
+            If True, store the difference of each sample from the previous
+            one along image rows (the TIFF horizontal predictor) instead of
+            the sample itself, which makes smooth integer images much more
+            compressible. Requires compression and integer data.
+        shape, dtype : tuple, numpy.dtype
+            The shape and type of the image data, if data is None.
+        returnoffset : bool
+            If True, return the file offset and size in bytes of the image
+            data if they are stored contiguously, i.e. uncompressed, else
+            None.
 
         """
         if photometric not in (None, 'minisblack', 'miniswhite', 'rgb'):
@@ -346,6 +467,8 @@ class TiffWriter(object):
             raise ValueError("invalid planarconfig %s" % planarconfig)
         if not 0 <= compress <= 9:
             raise ValueError("invalid compression level %s" % compress)
+        if predictor and not compress:
+            raise ValueError("the predictor requires compression")
 
         fh = self._fh
         byteorder = self._byteorder
@@ -355,9 +478,25 @@ class TiffWriter(object):
         offset_size = self._offset_size
         tag_size = self._tag_size
 
-        data = numpy.asarray(data, dtype=byteorder+data.dtype.char, order='C')
+        if data is None:
+            if shape is None or dtype is None:
+                raise ValueError("shape and dtype are required without data")
+            if compress or tile or pyramid:
+                raise ValueError("space can only be reserved for "
+                                 "uncompressed, untiled data")
+            # a placeholder of the right shape and type, without memory
+            data = numpy.broadcast_to(
+                numpy.zeros((), byteorder+numpy.dtype(dtype).char), shape)
+            empty = True
+        else:
+            data = numpy.asarray(data, dtype=byteorder+data.dtype.char,
+                                 order='C')
+            empty = False
         data_shape = shape = data.shape
         data = numpy.atleast_2d(data)
+        if predictor and data.dtype.kind not in 'iu':
+            raise ValueError("the horizontal predictor requires integer data, "
+                             "not %s" % data.dtype)
 
         # normalize shape of data
         samplesperpixel = 1
@@ -444,12 +583,43 @@ class TiffWriter(object):
         assert len(data.shape) in (5, 6)
         shape = data.shape
 
+        if tile:
+            tile = tuple(int(i) for i in tile)
+            if len(tile) not in (2, 3) or tile[-1] % 16 or tile[-2] % 16:
+                raise ValueError("invalid tile shape %s: length and width "
+                                 "must be multiples of 16" % str(tile))
+            if len(tile) == 3 and not volume:
+                raise ValueError("tile depth is only valid for volume data")
+            tile = ((tile[0] if len(tile) == 3 else shape[-4],) if volume
+                    else (1,)) + tile[-2:]
+        elif volume:
+            tile = shape[-4:-1]
+        if rowsperstrip is not None and (tile or volume):
+            raise ValueError("rowsperstrip is not valid for tiled data")
+        if rowsperstrip is not None and rowsperstrip < 1:
+            raise ValueError("invalid rowsperstrip %s" % rowsperstrip)
+        if pyramid:
+            if volume:
+                raise ValueError("pyramid levels are not supported for "
+                                 "volume data")
+            if min(shape[-3:-1]) >> pyramid < 1:
+                raise ValueError("image of shape %s is too small for %i "
+                                 "pyramid levels" % (shape[-3:-1], pyramid))
+        if tile:
+            # number of tiles along depth, length and width
+            tiles = tuple((i + j - 1) // j for i, j in
+                          zip((shape[-4] if volume else 1,) + shape[-3:-1],
+                              tile))
+            # tiles spanning whole rows are laid out like the plane itself
+            tiles_contiguous = (tile[1:] == shape[-3:-1] and
+                                (shape[-4] if volume else 1) % tile[0] == 0)
+
         bytestr = bytes if sys.version[0] == '2' else (
             lambda x: bytes(x, 'utf-8') if isinstance(x, str) else x)
         tags = []  # list of (code, ifdentry, ifdvalue, writeonce)
 
-        if volume:
-            # use tiles to save volume data
+        if tile:
+            # use tiles to save volume data, or if requested
             tag_byte_counts = TiffWriter.TAGS['tile_byte_counts']
             tag_offsets = TiffWriter.TAGS['tile_offsets']
         else:
@@ -513,15 +683,23 @@ class TiffWriter(object):
                datetime.datetime.now().strftime("%Y:%m:%d %H:%M:%S"),
                writeonce=True)
         addtag('compression', 'H', 1, 32946 if compress else 1)
+        if predictor:
+            addtag('predictor', 'H', 1, 2)
         addtag('orientation', 'H', 1, 1)
         addtag('image_width', 'I', 1, shape[-2])
         addtag('image_length', 'I', 1, shape[-3])
         if volume:
             addtag('image_depth', 'I', 1, shape[-4])
-            addtag('tile_depth', 'I', 1, shape[-4])
-            addtag('tile_width', 'I', 1, shape[-2])
-            addtag('tile_length', 'I', 1, shape[-3])
-        addtag('new_subfile_type', 'I', 1, 0 if shape[0] == 1 else 2)
+            addtag('tile_depth', 'I', 1, tile[0])
+        if tile:
+            addtag('tile_width', 'I', 1, tile[2])
+            addtag('tile_length', 'I', 1, tile[1])
+        if self._reduced:
+            addtag('new_subfile_type', 'I', 1, 1)
+        else:
+            addtag('new_subfile_type', 'I', 1, 0 if shape[0] == 1 else 2)
+        if pyramid:
+            addtag('sub_ifds', offset_format, pyramid, (0, ) * pyramid)
         addtag('sample_format', 'H', 1,
                {'u': 1, 'i': 2, 'f': 3, 'c': 6}[data.dtype.kind])
         addtag('photometric', 'H', 1,
@@ -543,13 +721,51 @@ class TiffWriter(object):
             addtag('x_resolution', '2I', 1, rational(resolution[0]))
             addtag('y_resolution', '2I', 1, rational(resolution[1]))
             addtag('resolution_unit', 'H', 1, 2)
-        addtag('rows_per_strip', 'I', 1,
-               shape[-3] * (shape[-4] if volume else 1))
-
-        # use one strip or tile per plane
-        strip_byte_counts = (data[0, 0].size * data.dtype.itemsize,) * shape[1]
-        addtag(tag_byte_counts, offset_format, shape[1], strip_byte_counts)
-        addtag(tag_offsets, offset_format, shape[1], (0, ) * shape[1])
+        if tile:
+            # use tiles, in planar sample, depth, length, width order
+            numsegments = shape[1] * product(tiles)
+            segment_size = product(tile) * shape[-1] * data.dtype.itemsize
+            strip_byte_counts = (segment_size,) * numsegments
+        else:
+            # use strips of rowsperstrip rows, the last of each plane shorter
+            rowsperstrip = min(int(rowsperstrip or shape[-3]), shape[-3])
+            addtag('rows_per_strip', 'I', 1, rowsperstrip)
+            stripsperplane = (shape[-3] + rowsperstrip - 1) // rowsperstrip
+            numsegments = shape[1] * stripsperplane
+            row_size = shape[-2] * shape[-1] * data.dtype.itemsize
+            strip_byte_counts = tuple(
+                min(rowsperstrip, shape[-3] - i*rowsperstrip) * row_size
+                for i in range(stripsperplane)) * shape[1]
+        addtag(tag_byte_counts, offset_format, numsegments, strip_byte_counts)
+        addtag(tag_offsets, offset_format, numsegments, (0, ) * numsegments)
+
+        def segments(page):
+            # yield the contiguous strips or tiles of a page, in file order
+            for plane in page:
+                if not tile:
+                    for i in range(0, shape[-3], rowsperstrip):
+                        strip = plane[i:i+rowsperstrip]
+                        yield (horizontal_difference(strip) if predictor
+                               else strip)
+                    continue
+                if not volume:
+                    plane = plane[numpy.newaxis]
+                for d in range(tiles[0]):
+                    for l in range(tiles[1]):
+                        for w in range(tiles[2]):
+                            chunk = plane[d*tile[0]:(d+1)*tile[0],
+                                          l*tile[1]:(l+1)*tile[1],
+                                          w*tile[2]:(w+1)*tile[2]]
+                            if chunk.shape[:3] != tile:
+                                padded = numpy.zeros(tile + chunk.shape[3:],
+                                                     data.dtype)
+                                padded[:chunk.shape[0], :chunk.shape[1],
+                                       :chunk.shape[2]] = chunk
+                                chunk = padded
+                            if predictor:
+                                yield horizontal_difference(chunk)
+                            else:
+                                yield numpy.ascontiguousarray(chunk)
 
         # add extra tags from users
         for t in extratags:
@@ -561,6 +777,24 @@ class TiffWriter(object):
                                   > 2**31-1):
             raise ValueError("data too large for non-bigtiff file")
 
+        if compress:
+            # segments of all pages, compressed in order, possibly in parallel
+            compressed = compress_iter((segment for page in data
+                                        for segment in segments(page)),
+                                       compress, maxworkers)
+
+        contiguous = not (compress or pyramid or
+                          (tile and not tiles_contiguous))
+        if contiguous:
+            # the data of all pages follow the IFDs of all pages
+            def ifdsize(tags):
+                return (struct.calcsize(numtag_format) + len(tags)*tag_size +
+                        offset_size + sum(len(t[2]) for t in tags if t[2]))
+            data_start = fh.tell() + ifdsize(tags) + (shape[0] - 1) * ifdsize(
+                [t for t in tags if not t[-1]])
+            data_start += -data_start % 16  # align data
+            page_size = product(shape[1:]) * data.dtype.itemsize
+
         for pageindex in range(shape[0]):
             # update pointer at ifd_offset
             pos = fh.tell()
@@ -586,20 +820,26 @@ class TiffWriter(object):
                         strip_offsets_offset = pos
                     elif tag[0] == tag_byte_counts:
                         strip_byte_counts_offset = pos
+                    elif tag[0] == TiffWriter.TAGS['sub_ifds']:
+                        sub_ifds_offset = pos
                     fh.write(tag[2])
+                elif tag[0] == TiffWriter.TAGS['sub_ifds']:
+                    sub_ifds_offset = (tag_offset + tagindex*tag_size +
+                                       offset_size + 4)
 
             # write image data
             data_offset = fh.tell()
-            if compress:
+            if contiguous:
+                data_offset = data_start + pageindex * page_size
+            elif compress:
                 strip_byte_counts = []
-                for plane in data[pageindex]:
-                    plane = zlib.compress(plane, compress)
-                    strip_byte_counts.append(len(plane))
-                    fh.write(plane)
+                for _ in range(numsegments):
+                    segment = next(compressed)
+                    strip_byte_counts.append(len(segment))
+                    fh.write(segment)
             else:
-                # if this fails try update Python/numpy
-                data[pageindex].tofile(fh)
-                fh.flush()
+                for segment in segments(data[pageindex]):
+                    fh.write(segment.tobytes())
 
             # update strip and tile offsets and byte_counts if necessary
             pos = fh.tell()
@@ -628,12 +868,56 @@ class TiffWriter(object):
                     break
             fh.seek(pos)
             fh.flush()
+
+            if pyramid:
+                # write reduced images, linked from the sub_ifds tag
+                next_ifd_offset = self._ifd_offset
+                level = data[pageindex]
+                self._reduced = True
+                try:
+                    for i in range(pyramid):
+                        level = block_average(level)
+                        if planarconfig == 'planar':
+                            image = level[..., 0]
+                        elif planarconfig == 'contig':
+                            image = level[0]
+                        else:
+                            image = level[0, ..., 0]
+                        self._ifd_offset = sub_ifds_offset + i * offset_size
+                        self.save(image, photometric=photometric,
+                                  planarconfig=planarconfig,
+                                  compress=compress, maxworkers=maxworkers,
+                                  tile=tile[1:] if tile else None,
+                                  rowsperstrip=None if tile else rowsperstrip,
+                                  predictor=predictor)
+                finally:
+                    self._reduced = False
+                self._ifd_offset = next_ifd_offset
+
             # remove tags that should be written only once
             if pageindex == 0:
                 tags = [t for t in tags if not t[-1]]
 
+        if contiguous:
+            nbytes = shape[0] * page_size
+            fh.seek(data_start)
+            if empty:
+                if nbytes:
+                    # reserve space, sparsely on most file systems
+                    fh.seek(data_start + nbytes - 1)
+                    fh.write(b'\0')
+            elif self._tofile:
+                # if this fails try update Python/numpy
+                data.tofile(fh)
+            else:
+                fh.write(data.tobytes())
+            fh.flush()
+            if returnoffset:
+                return data_start, nbytes
+
     def close(self):
-        self._fh.close()
+        if self._close:
+            self._fh.close()
 
     def __enter__(self):
         return self
@@ -642,6 +926,78 @@ class TiffWriter(object):
         self.close()
 
 
+def block_average(data, factor=2):
+    """Return data averaged over blocks of factor x factor pixels.
+
+    The image length and width are the third and second last dimensions of
+    data, as in the normalized shape used by TiffWriter.save. Rows and
+    columns that do not fill a block are discarded. Integer data are
+    rounded to the nearest integer.
+
+    >>> data = numpy.arange(20, dtype='uint8').reshape(1, 4, 5, 1)
+    >>> block_average(data)[0, ..., 0]
+    array([[ 3,  5],
+           [13, 15]], dtype=uint8)
+
+    """
+    length = data.shape[-3] // factor
+    width = data.shape[-2] // factor
+    data = data[..., :length*factor, :width*factor, :]
+    blocks = data.reshape(data.shape[:-3] + (length, factor, width, factor,
+                                             data.shape[-1]))
+    if data.dtype.kind in 'ui':
+        n = factor * factor
+        total = blocks.sum(axis=(-4, -2), dtype=data.dtype.kind + '8')
+        return ((total + n // 2) // n).astype(data.dtype)
+    return blocks.mean(axis=(-4, -2)).astype(data.dtype)
+
+
+def horizontal_difference(data):
+    """Return the differences of data along image rows, for the predictor.
+
+    Image width and samples are the last two dimensions of data. The first
+    sample of each row is kept, and integer overflow wraps around, so that
+    a cumulative sum along rows restores the data.
+
+    >>> data = numpy.array([[1, 3, 2], [5, 5, 9]], dtype='uint8')[..., None]
+    >>> horizontal_difference(data)[..., 0]
+    array([[  1,   2, 255],
+           [  5,   0,   4]], dtype=uint8)
+
+    """
+    result = numpy.empty(data.shape, data.dtype)
+    result[..., :1, :] = data[..., :1, :]
+    numpy.subtract(data[..., 1:, :], data[..., :-1, :],
+                   out=result[..., 1:, :])
+    return result
+
+
+def compress_iter(chunks, level, maxworkers=None):
+    """Return iterator over zlib compressed chunks, in input order.
+
+    If maxworkers is greater than 1, chunks are compressed on a pool of
+    threads, with at most 2*maxworkers chunks in flight at a time.
+
+    >>> chunks = [b'a' * 100, b'b' * 100, b'c' * 100]
+    >>> [zlib.decompress(c)[:1] for c in compress_iter(chunks, 6, 2)]
+    [b'a', b'b', b'c']
+
+    """
+    if not maxworkers or maxworkers < 2:
+        for chunk in chunks:
+            yield zlib.compress(chunk, level)
+        return
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(maxworkers) as executor:
+        futures = collections.deque()
+        for chunk in chunks:
+            futures.append(executor.submit(zlib.compress, chunk, level))
+            if len(futures) > 2 * maxworkers:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
 def imread(files, **kwargs):
     """Return image data from TIFF file(s) as numpy array.
 
@@ -725,8 +1081,8 @@ class TiffFile(object):
 
     Attributes
     ----------
-    pages : list
-        All TIFF pages in file.
+    pages : TiffPages
+        All TIFF pages in file, parsed when first accessed.
     series : list of Records(shape, dtype, axes, TiffPages)
         TIFF pages with compatible shapes and types.
     micromanager_metadata: dict
@@ -797,7 +1153,7 @@ class TiffFile(object):
         self._files = {}
 
     def _fromfile(self):
-        """Read TIFF header and all page records from file."""
+        """Read TIFF header and first page record from file."""
         self._fh.seek(0)
         try:
             self.byteorder = {b'II': '<', b'MM': '>'}[self._fh.read(2)]
@@ -813,13 +1169,7 @@ class TiffFile(object):
             self.offset_size = 4
         else:
             raise ValueError("not a TIFF file")
-        self.pages = []
-        while True:
-            try:
-                page = TiffPage(self)
-                self.pages.append(page)
-            except StopIteration:
-                break
+        self.pages = TiffPages(self)
         if not self.pages:
             raise ValueError("empty TIFF file")
 
@@ -977,7 +1327,8 @@ class TiffFile(object):
 
         return series
 
-    def asarray(self, key=None, series=None, memmap=False):
+    def asarray(self, key=None, series=None, memmap=False, level=0,
+                maxworkers=None, region=None):
         """Return image data from multiple TIFF pages as numpy array.
 
         By default the first image series is returned.
@@ -991,6 +1342,16 @@ class TiffFile(object):
         memmap : bool
             If True, return an array stored in a binary file on disk
             if possible.
+        level : int
+            If greater than 0, return the reduced images of the selected
+            pages at this pyramid level, i.e. their subifds[level-1].
+        maxworkers : int
+            Maximum number of threads used to decompress the strips or tiles
+            of each page. See TiffPage.asarray.
+        region : (int, int, int, int)
+            If not None, return only the region (y0, y1, x0, x1) of each
+            page, decoding only the strips or tiles it intersects.
+            See TiffPage.asarray. Not supported for NIH and OME-TIFF files.
 
         """
         if key is None and series is None:
@@ -1014,7 +1375,28 @@ class TiffFile(object):
         if not len(pages):
             raise ValueError("no pages selected")
 
-        if self.is_nih:
+        fullshape = pages[0].shape
+        if level:
+            try:
+                pages = [page.subifds[level-1] for page in pages]
+            except IndexError:
+                raise ValueError("no pyramid level %i" % level)
+
+        pageshape = pages[0].shape
+        if region is not None:
+            if self.is_nih or self.is_ome:
+                raise ValueError("region not supported for NIH and OME-TIFF")
+            pageshape = pages[0]._crop_shape(region)
+
+        offset = None
+        if memmap and len(pages) > 1 and region is None:
+            offset = self._memmap_offset(pages)
+        if offset is not None:
+            # the data of all pages are contiguous in the file
+            result = self._fh.memmap_array(
+                self.byteorder + pages[0]._dtype,
+                (len(pages), ) + pages[0].shape, offset=offset)
+        elif self.is_nih:
             if pages[0].is_palette:
                 result = stack_pages(pages, colormapped=False, squeeze=False)
                 result = numpy.take(pages[0].color_map, result, axis=1)
@@ -1023,7 +1405,8 @@ class TiffFile(object):
                 result = stack_pages(pages, memmap=memmap,
                                      colormapped=False, squeeze=False)
         elif len(pages) == 1:
-            return pages[0].asarray(memmap=memmap)
+            return pages[0].asarray(memmap=memmap, maxworkers=maxworkers,
+                                    region=region)
         elif self.is_ome:
             assert not self.is_palette, "color mapping disabled for ome-tiff"
             if any(p is None for p in pages):
@@ -1063,7 +1446,7 @@ class TiffFile(object):
                 keep.open(page)
                 if page:
                     a = page.asarray(memmap=False, colormapped=False,
-                                     reopen=False)
+                                     reopen=False, maxworkers=maxworkers)
                 else:
                     a = nopage
                 try:
@@ -1074,9 +1457,13 @@ class TiffFile(object):
                 index += a.size
             keep.close()
         else:
-            result = stack_pages(pages, memmap=memmap)
+            result = stack_pages(pages, memmap=memmap, maxworkers=maxworkers,
+                                 region=region)
 
-        if key is None:
+        if key is None and (level or region is not None):
+            shape = self.series[series].shape
+            result.shape = shape[:len(shape)-len(fullshape)] + pageshape
+        elif key is None:
             try:
                 result.shape = self.series[series].shape
             except ValueError:
@@ -1089,9 +1476,28 @@ class TiffFile(object):
                     # revert to generic shape
                     result.shape = (-1,) + pages[0].shape
         else:
-            result.shape = (-1,) + pages[0].shape
+            result.shape = (-1,) + pageshape
         return result
 
+    def _memmap_offset(self, pages):
+        """Return file offset of the data of pages if they can be mapped
+        as one array, else None."""
+        page0 = pages[0]
+        if (self.is_ome or self.is_nih or not page0.is_contiguous or
+                not page0._is_memmappable(False, True)):
+            return None
+        offset, size = page0.is_contiguous
+        if size != (product(page0.shape) *
+                    numpy.dtype(page0._dtype).itemsize):
+            return None
+        for i, page in enumerate(pages[1:], 1):
+            if (page is None or page.parent is not self or
+                    page.shape != page0.shape or page.dtype != page0.dtype or
+                    not page._is_memmappable(False, True) or
+                    page.is_contiguous != (offset + i * size, size)):
+                return None
+        return offset
+
     def _omeseries(self):
         """Return image series in OME-TIFF file(s)."""
         root = etree.fromstring(self.pages[0].tags['image_description'].value)
@@ -1300,6 +1706,103 @@ class TiffFile(object):
         return self.pages[0].is_ome
 
 
+class TiffPages(object):
+    """Sequence of the TiffPages in a file, parsed when first accessed.
+
+    Only the position of the first IFD is read when a file is opened. The
+    chain of IFDs is followed as far as needed to find a page, reading just
+    the number of tags in each IFD, so that a page can be accessed without
+    parsing the pages before it. Pages are cached once parsed.
+
+    """
+    def __init__(self, parent):
+        """Initialize instance at the file position of the first IFD offset.
+        """
+        self.parent = parent
+        self._pages = []
+        # file positions at which the offsets of the known IFDs are stored
+        self._pointers = []
+        self._next = parent.filehandle.tell()
+        self._complete = False
+
+    def _walk(self, count=None):
+        """Find the IFDs of the first `count` pages, or of all pages.
+
+        Return the number of IFDs found.
+
+        """
+        if self._complete or (count is not None and
+                              count <= len(self._pointers)):
+            return len(self._pointers)
+        fh = self.parent.filehandle
+        byteorder = self.parent.byteorder
+        offset_size = self.parent.offset_size
+        offset_fmt = byteorder + {4: 'I', 8: 'Q'}[offset_size]
+        numtags_fmt, numtags_size, tag_size = {
+            4: (byteorder + 'H', 2, 12), 8: (byteorder + 'Q', 8, 20)
+        }[offset_size]
+        while count is None or len(self._pointers) < count:
+            fh.seek(self._next)
+            offset = struct.unpack(offset_fmt, fh.read(offset_size))[0]
+            if not offset:
+                self._complete = True
+                break
+            fh.seek(offset)
+            try:
+                numtags = struct.unpack(numtags_fmt,
+                                        fh.read(numtags_size))[0]
+            except Exception:
+                warnings.warn("corrupted page list")
+                self._complete = True
+                break
+            self._pointers.append(self._next)
+            self._pages.append(None)
+            self._next = offset + numtags_size + numtags * tag_size
+        return len(self._pointers)
+
+    def _page(self, index):
+        """Return the page at `index`, which must have been found."""
+        page = self._pages[index]
+        if page is False:
+            # the page is being parsed, e.g. it is checking parent.is_ome
+            raise IndexError("page index out of range")
+        if page is None:
+            self._pages[index] = False
+            try:
+                self.parent.filehandle.seek(self._pointers[index])
+                page = TiffPage(self.parent, index)
+            finally:
+                self._pages[index] = page
+        return page
+
+    def __len__(self):
+        """Return number of pages in file."""
+        return self._walk()
+
+    def __bool__(self):
+        """Return True if the file has any pages."""
+        return self._walk(1) > 0
+
+    __nonzero__ = __bool__
+
+    def __getitem__(self, key):
+        """Return specified page(s)."""
+        if isinstance(key, slice):
+            return [self._page(i) for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if key < 0 or key >= self._walk(key + 1):
+            raise IndexError("page index out of range")
+        return self._page(key)
+
+    def __iter__(self):
+        """Return iterator over pages."""
+        i = 0
+        while i < self._walk(i + 1):
+            yield self._page(i)
+            i += 1
+
+
 class TiffPage(object):
     """A TIFF image file directory (IFD).
 
@@ -1344,10 +1847,10 @@ class TiffPage(object):
     5. contig samples_per_pixel
 
     """
-    def __init__(self, parent):
+    def __init__(self, parent, index=None):
         """Initialize instance from file."""
         self.parent = parent
-        self.index = len(parent.pages)
+        self.index = len(parent.pages) if index is None else index
         self.shape = self._shape = ()
         self.dtype = self._dtype = None
         self.axes = ""
@@ -1646,12 +2149,14 @@ class TiffPage(object):
         assert len(self.shape) == len(self.axes)
 
     def asarray(self, squeeze=True, colormapped=True, rgbonly=False,
-                scale_mdgel=False, memmap=False, reopen=True):
+                scale_mdgel=False, memmap=False, reopen=True, maxworkers=None,
+                region=None):
         """Read image data from file and return as numpy array.
 
         Raise ValueError if format is unsupported.
-        If any of 'squeeze', 'colormapped', or 'rgbonly' are not the default,
-        the shape of the returned array might be different from the page shape.
+        If any of 'squeeze', 'colormapped', 'rgbonly', or 'region' are not the
+        default, the shape of the returned array might be different from the
+        page shape.
 
         Parameters
         ----------
@@ -1671,6 +2176,18 @@ class TiffPage(object):
         scale_mdgel : bool
             If True, MD Gel data will be scaled according to the private
             metadata in the second TIFF page. The dtype will be float32.
+        maxworkers : int
+            Maximum number of threads used to decompress strips or tiles.
+            If greater than 1, the compressed data are read in bulk and
+            decoded in parallel into the result, including the horizontal
+            predictor. Zlib releases the GIL, so decoding of deflate
+            compressed pages scales with the number of threads.
+            If None or 1 (default), strips and tiles are decoded one by one.
+        region : (int, int, int, int)
+            If not None, return only the rows y0 to y1 and the columns x0 to
+            x1 of the image, given as (y0, y1, x0, x1). Only the tiles, or
+            strips, that intersect the region are read and decoded, and only
+            the rows of the region are read from uncompressed data.
 
         """
         if not self._shape:
@@ -1700,6 +2217,14 @@ class TiffPage(object):
         image_depth = self.image_depth
         typecode = self.parent.byteorder + dtype
         bits_per_sample = self.bits_per_sample
+        predicted = False  # the predictor was undone while decoding
+        if region is not None:
+            y0, y1, x0, x1 = region
+            if not (0 <= y0 < y1 <= image_length and
+                    0 <= x0 < x1 <= image_width):
+                raise ValueError("invalid region %s" % str(region))
+        # image position of the first row and column of a cropped result
+        origin = None
 
         if self.is_tiled:
             if 'tile_offsets' in self.tags:
@@ -1728,6 +2253,18 @@ class TiffPage(object):
 
         if memmap and self._is_memmappable(rgbonly, colormapped):
             result = fh.memmap_array(typecode, shape, offset=offsets[0])
+        elif region is not None and self.is_contiguous and image_depth == 1:
+            # read only the rows of the region from each plane
+            result = numpy.empty(shape[:3] + (y1 - y0, ) + shape[-2:], dtype)
+            row_size = product(shape[-2:])
+            plane_size = image_length * row_size
+            itemsize = numpy.dtype(typecode).itemsize
+            for plane in range(shape[0] * shape[1]):
+                fh.seek(offsets[0] + (plane * plane_size +
+                                      y0 * row_size) * itemsize)
+                result.reshape(-1, (y1 - y0) * row_size)[plane] = \
+                    fh.read_array(typecode, (y1 - y0) * row_size)
+            origin = (y0, 0)
         elif self.is_contiguous:
             fh.seek(offsets[0])
             result = fh.read_array(typecode, product(shape))
@@ -1761,7 +2298,105 @@ class TiffPage(object):
                 table = self.jpeg_tables if 'jpeg_tables' in self.tags else b''
                 decompress = lambda x: decodejpg(x, table, self.photometric)
 
-            if self.is_tiled:
+            parallel = maxworkers and maxworkers > 1 and len(offsets) > 1
+            planar_strips = False
+            if not self.is_tiled:
+                rows = self.rows_per_strip
+                row_size = shape[-2] * shape[-1]
+                strips_per_plane = (image_length + rows - 1) // rows
+                # each plane starts with a new strip
+                planar_strips = (image_depth == 1 and len(offsets) ==
+                                 shape[0] * shape[1] * strips_per_plane)
+                parallel = parallel and planar_strips
+
+            if region is not None and self.is_tiled:
+                # decode only the tiles that intersect the region
+                ty0, ty1 = y0 // tile_length, (y1 - 1) // tile_length + 1
+                tx0, tx1 = x0 // tile_width, (x1 - 1) // tile_width + 1
+                result = numpy.empty(shape[:3] +
+                                     ((ty1 - ty0) * tile_length,
+                                      (tx1 - tx0) * tile_width, shape[-1]),
+                                     dtype)
+                for pl in range(shape[1]):
+                    for d in range(td):
+                        for ty in range(ty0, ty1):
+                            for tx in range(tx0, tx1):
+                                index = ((pl * td + d) * tl + ty) * tw + tx
+                                fh.seek(offsets[index])
+                                tile = unpack(decompress(
+                                    fh.read(byte_counts[index])))
+                                tile.shape = tile_shape
+                                if self.predictor == 'horizontal':
+                                    numpy.cumsum(tile, axis=-2, dtype=dtype,
+                                                 out=tile)
+                                result[0, pl,
+                                       d*tile_depth:(d+1)*tile_depth,
+                                       (ty-ty0)*tile_length:
+                                       (ty-ty0+1)*tile_length,
+                                       (tx-tx0)*tile_width:
+                                       (tx-tx0+1)*tile_width, :] = tile
+                result = result[..., :image_depth, :, :, :]
+                origin = (ty0 * tile_length, tx0 * tile_width)
+                predicted = True
+            elif region is not None and planar_strips:
+                # decode only the strips that intersect the region
+                s0, s1 = y0 // rows, (y1 - 1) // rows + 1
+                nrows = min(s1 * rows, image_length) - s0 * rows
+                result = numpy.empty((shape[0] * shape[1], nrows * row_size),
+                                     dtype)
+                for plane in range(len(result)):
+                    index = 0
+                    for i in range(plane * strips_per_plane + s0,
+                                   plane * strips_per_plane + s1):
+                        fh.seek(offsets[i])
+                        strip = unpack(decompress(fh.read(byte_counts[i])))
+                        size = min(strip.size, rows * row_size,
+                                   result.shape[1] - index)
+                        result[plane, index:index+size] = strip[:size]
+                        index += size
+                result.shape = shape[:3] + (nrows, ) + shape[-2:]
+                origin = (s0 * rows, 0)
+            elif parallel and self.is_tiled:
+                result = numpy.empty(shape, dtype)
+                tiles = (shape[1], shape[2] // tile_depth,
+                         shape[3] // tile_length, shape[4] // tile_width)
+
+                def decode(index, data):
+                    tile = unpack(decompress(data))
+                    tile.shape = tile_shape
+                    if self.predictor == 'horizontal':
+                        numpy.cumsum(tile, axis=-2, dtype=dtype, out=tile)
+                    pl, td, tl, tw = numpy.unravel_index(index, tiles)
+                    result[0, pl, td*tile_depth:(td+1)*tile_depth,
+                           tl*tile_length:(tl+1)*tile_length,
+                           tw*tile_width:(tw+1)*tile_width, :] = tile
+
+                decode_parallel(decode, fh, offsets, byte_counts, maxworkers)
+                result = result[...,
+                                :image_depth, :image_length, :image_width, :]
+            elif parallel:
+                result = numpy.empty(shape, dtype).reshape(-1)
+                plane_size = product(shape[2:])
+                predict = (self.predictor == 'horizontal' and
+                           not (self.parent.is_lsm and not self.compression))
+
+                def decode(index, data):
+                    plane, i = divmod(index, strips_per_plane)
+                    start = plane * plane_size + i * rows * row_size
+                    size = min(rows, image_length - i * rows) * row_size
+                    strip = unpack(decompress(data))
+                    size = min(size, strip.size)
+                    out = result[start:start+size]
+                    out[:] = strip[:size]
+                    if predict:
+                        # undo the predictor on the complete rows of strip
+                        out = out[:size - size % row_size].reshape(
+                            -1, shape[-2], shape[-1])
+                        numpy.cumsum(out, axis=-2, dtype=dtype, out=out)
+
+                decode_parallel(decode, fh, offsets, byte_counts, maxworkers)
+                predicted = True
+            elif self.is_tiled:
                 result = numpy.empty(shape, dtype)
                 tw, tl, td, pl = 0, 0, 0, 0
                 for offset, bytecount in zip(offsets, byte_counts):
@@ -1798,14 +2433,20 @@ class TiffPage(object):
                     del strip
                     index += size
 
-        result.shape = self._shape
+        if origin is None:
+            result.shape = self._shape
 
-        if self.predictor == 'horizontal' and not (self.is_tiled and not
-                                                   self.is_contiguous):
+        if self.predictor == 'horizontal' and not predicted and not (
+                self.is_tiled and not self.is_contiguous):
             # work around bug in LSM510 software
             if not (self.parent.is_lsm and not self.compression):
                 numpy.cumsum(result, axis=-2, dtype=dtype, out=result)
 
+        if region is not None:
+            y, x = origin or (0, 0)
+            result = numpy.ascontiguousarray(
+                result[..., y0-y:y1-y, x0-x:x1-x, :])
+
         if colormapped and self.is_palette:
             if self.color_map.shape[1] >= 2**bits_per_sample:
                 # FluoView and LSM might fail here
@@ -1830,11 +2471,12 @@ class TiffPage(object):
                     result = result[:, :3]
 
         if squeeze:
+            shape = self.shape if region is None else self._crop_shape(region)
             try:
-                result.shape = self.shape
+                result.shape = shape
             except ValueError:
                 warnings.warn("failed to reshape from %s to %s" % (
-                    str(result.shape), str(self.shape)))
+                    str(result.shape), str(shape)))
 
         if scale_mdgel and self.parent.is_mdgel:
             # MD Gel stores private metadata in the second page
@@ -1852,6 +2494,14 @@ class TiffPage(object):
             fh.close()
         return result
 
+    def _crop_shape(self, region):
+        """Return shape of image data in region (y0, y1, x0, x1)."""
+        shape = list(self.shape)
+        y = self.axes.index('Y') - len(self.axes)
+        shape[y] = region[1] - region[0]
+        shape[y + 1] = region[3] - region[2]
+        return tuple(shape)
+
     def _is_memmappable(self, rgbonly, colormapped):
         """Return if image data in file can be memory mapped."""
         if not self.parent.filehandle.is_file or not self.is_contiguous:
@@ -1991,6 +2641,24 @@ class TiffPage(object):
         return ('photometric' in self.tags and
                 self.tags['photometric'].value == 3)
 
+    @lazyattr
+    def subifds(self):
+        """Return the TiffPages in the sub_ifds tag, e.g. reduced images."""
+        if 'sub_ifds' not in self.tags:
+            return []
+        tag = self.tags['sub_ifds']
+        fh = self.parent.filehandle
+        pos = fh.tell()
+        pages = []
+        try:
+            for i in range(tag.count):
+                # TiffPage reads the IFD offset at the file position
+                fh.seek(tag.value_offset + i * self.parent.offset_size)
+                pages.append(TiffPage(self.parent, self.index))
+        finally:
+            fh.seek(pos)
+        return pages
+
     @lazyattr
     def is_tiled(self):
         """True if page contains tiled image."""
@@ -3083,12 +3751,21 @@ def imagej_description(description):
     return result
 
 
+# Functions that may be replaced by compiled versions, see `_replace_by`
+ACCELERATORS = {}
+
+
 def _replace_by(module_function, package=None, warn=False):
     """Try replace decorated function by module.function.
 
     This is used to replace local functions with functions from another
     (usually compiled) module, if available.
 
+    Both implementations, and why the other module could not be used, are
+    recorded in `ACCELERATORS` under the name of the decorated function.
+    Errors other than the module or function not existing are always
+    warned about.
+
     Parameters
     ----------
     module_function : str
@@ -3096,7 +3773,7 @@ def _replace_by(module_function, package=None, warn=False):
     package : str, optional
         The parent package of the module
     warn : bool, optional
-        Whether to warn when wrapping fails
+        Whether to warn when the module or function does not exist
 
     Returns
     -------
@@ -3111,23 +3788,52 @@ def _replace_by(module_function, package=None, warn=False):
 
     """
     def decorate(func, module_function=module_function, warn=warn):
+        accelerator = {'module_function': module_function, 'python': func,
+                       'native': None, 'error': None}
+        ACCELERATORS[func.__name__] = accelerator
         try:
             modname, function = module_function.split('.')
             if package is None:
                 full_name = modname
             else:
                 full_name = package + '.' + modname
-            module = __import__(full_name, romlist=[modname])
-            func, oldfunc = getattr(module, function), func
-            globals()['__old_' + func.__name__] = oldfunc
-        except Exception:
+            module = __import__(full_name, fromlist=[modname])
+            native = getattr(module, function)
+        except (ImportError, AttributeError) as e:
+            accelerator['error'] = str(e)
             if warn:
                 warnings.warn("failed to import %s" % module_function)
-        return func
+            return func
+        except Exception as e:
+            accelerator['error'] = str(e)
+            warnings.warn("failed to import %s: %s" % (module_function, e))
+            return func
+        globals()['__old_' + func.__name__] = func
+        accelerator['native'] = native
+        return native
 
     return decorate
 
 
+def accelerators():
+    """Return which implementation of each replaceable function is used.
+
+    Returns
+    -------
+    report : dict
+        'native' or 'python', for each function in `ACCELERATORS`.
+
+    Examples
+    --------
+    >>> accelerators()['decodelzw'] in ('native', 'python')
+    True
+
+    """
+    return dict((name, 'python' if accelerator['native'] is None
+                 else 'native')
+                for name, accelerator in ACCELERATORS.items())
+
+
 def decodejpg(encoded, tables=b'', photometric=None,
               ycbcr_subsampling=None, ycbcr_positioning=None):
     """Decode JPEG encoded byte string (using _czifile extension module)."""
@@ -3145,24 +3851,40 @@ def decodepackbits(encoded):
 
     PackBits is a simple byte-oriented run-length compression scheme.
 
+    Only the run headers are visited in Python. The output is produced by a
+    single `numpy.repeat` of the encoded bytes, in which headers occur zero
+    times, literal bytes once, and replicated bytes as often as their run.
+
+    Examples
+    --------
+    >>> decodepackbits(b'\\xfe\\xaa\\x02\\x80\\x00\\x2a')
+    b'\\xaa\\xaa\\xaa\\x80\\x00*'
+
     """
-    func = ord if sys.version[0] == '2' else lambda x: x
-    result = []
-    result_extend = result.extend
+    data = numpy.frombuffer(encoded, 'uint8')
+    size = data.size
+    if not size:
+        return b''
+    heads = []
+    heads_append = heads.append
+    encoded = bytearray(encoded)  # items are int on Python 2 and 3
     i = 0
-    try:
-        while True:
-            n = func(encoded[i]) + 1
+    while i < size:
+        heads_append(i)
+        n = encoded[i]
+        if n < 128:
+            i += n + 2
+        elif n > 128:
+            i += 2
+        else:
             i += 1
-            if n < 129:
-                result_extend(encoded[i:i+n])
-                i += n
-            elif n > 129:
-                result_extend(encoded[i:i+1] * (258-n))
-                i += 1
-    except IndexError:
-        pass
-    return b''.join(result) if sys.version[0] == '2' else bytes(result)
+    heads = numpy.array(heads, 'intp')
+    header = data[heads].astype('intp')
+    counts = numpy.ones(size, 'intp')
+    counts[heads] = 0
+    runs = (header > 128) & (heads + 1 < size)
+    counts[heads[runs] + 1] = 257 - header[runs]
+    return numpy.repeat(data, counts).tobytes()
 
 
 @_replace_by('_tifffile.decodelzw')
@@ -3174,10 +3896,39 @@ def decodelzw(encoded):
     This is an implementation of the LZW decoding algorithm described in (1).
     It is not compatible with old style LZW compressed files like quad-lzw.tif.
 
+    The width of a code depends only on how many codes were read since the
+    last CLEAR code, so the codes are unpacked with NumPy, a few thousand at
+    a time, and only the table lookups are done in Python.
+
     """
     len_encoded = len(encoded)
     bitcount_max = len_encoded * 8
-    unpack = struct.unpack
+
+    if len_encoded < 4:
+        raise ValueError("strip must be at least 4 characters long")
+
+    # the 24 bits starting at each byte hold any code starting in that byte
+    data = numpy.zeros(len_encoded + 8, 'uint32')
+    data[:len_encoded] = numpy.frombuffer(encoded, 'uint8')
+    window = (data[:-2] << 16) | (data[1:-1] << 8) | data[2:]
+
+    def unpack_codes(bitcount, first, count=4096):
+        """Return codes `first` to `first+count` after a CLEAR code.
+
+        The codes start at `bitcount`. Also return the bit position after
+        each code. Codes starting well beyond the end of the strip are
+        omitted.
+
+        """
+        index = numpy.arange(first, first + count)
+        bitw = 9 + (index >= 254) + (index >= 766) + (index >= 1790)
+        end = bitcount + numpy.cumsum(bitw)
+        start = end - bitw
+        count = numpy.searchsorted(start, bitcount_max + 24)
+        bitw, start, end = bitw[:count], start[:count], end[:count]
+        codes = window[start >> 3] >> (24 - bitw - (start & 7))
+        codes &= (1 << bitw) - 1
+        return codes, end
 
     if sys.version[0] == '2':
         newtable = [chr(i) for i in range(256)]
@@ -3185,65 +3936,47 @@ def decodelzw(encoded):
         newtable = [bytes([i]) for i in range(256)]
     newtable.extend((0, 0))
 
-    def next_code():
-        """Return integer of `bitw` bits at `bitcount` position in encoded."""
-        start = bitcount // 8
-        s = encoded[start:start+4]
-        try:
-            code = unpack('>I', s)[0]
-        except Exception:
-            code = unpack('>I', s + b'\x00'*(4-len(s)))[0]
-        code <<= bitcount % 8
-        code &= mask
-        return code >> shr
-
-    switchbitch = {  # code: bit-width, shr-bits, bit-mask
-        255: (9, 23, int(9*'1'+'0'*23, 2)),
-        511: (10, 22, int(10*'1'+'0'*22, 2)),
-        1023: (11, 21, int(11*'1'+'0'*21, 2)),
-        2047: (12, 20, int(12*'1'+'0'*20, 2)), }
-    bitw, shr, mask = switchbitch[255]
-    bitcount = 0
-
-    if len_encoded < 4:
-        raise ValueError("strip must be at least 4 characters long")
-
-    if next_code() != 256:
+    if unpack_codes(0, 0, 1)[0][0] != 256:
         raise ValueError("strip must begin with CLEAR code")
 
-    code = 0
-    oldcode = 0
+    bitcount = 9
     result = []
     result_append = result.append
-    while True:
-        code = next_code()  # ~5% faster when inlining this function
-        bitcount += bitw
-        if code == 257 or bitcount >= bitcount_max:  # EOI
+    while True:  # after CLEAR
+        table = newtable[:]
+        table_append = table.append
+        codes, ends = unpack_codes(bitcount, 0)
+        code = int(codes[0])
+        if code == 257:  # EOI
             break
-        if code == 256:  # CLEAR
-            table = newtable[:]
-            table_append = table.append
-            lentable = 258
-            bitw, shr, mask = switchbitch[255]
-            code = next_code()
-            bitcount += bitw
-            if code == 257:  # EOI
-                break
-            result_append(table[code])
-        else:
-            if code < lentable:
-                decoded = table[code]
-                newcode = table[oldcode] + decoded[:1]
-            else:
-                newcode = table[oldcode]
-                newcode += newcode[:1]
-                decoded = newcode
-            result_append(decoded)
-            table_append(newcode)
-            lentable += 1
+        result_append(table[code])
         oldcode = code
-        if lentable in switchbitch:
-            bitw, shr, mask = switchbitch[lentable]
+        first = 0
+        i = 1
+        while True:
+            stop = numpy.flatnonzero((codes[i:] == 256) | (codes[i:] == 257) |
+                                     (ends[i:] >= bitcount_max))
+            stop = i + stop[0] if stop.size else codes.size
+            for code in codes[i:stop].tolist():
+                try:
+                    decoded = table[code]
+                    newcode = table[oldcode] + decoded[:1]
+                except IndexError:  # code not yet in table
+                    newcode = table[oldcode]
+                    newcode += newcode[:1]
+                    decoded = newcode
+                result_append(decoded)
+                table_append(newcode)
+                oldcode = code
+            if stop < codes.size:
+                break
+            first += codes.size
+            codes, ends = unpack_codes(int(ends[-1]), first)
+            i = 0
+        code = int(codes[stop])
+        bitcount = int(ends[stop])
+        if code == 257 or bitcount >= bitcount_max:  # EOI
+            break
 
     if code != 257:
         warnings.warn("unexpected end of lzw stream (code %i)" % code)
@@ -3439,6 +4172,42 @@ def transpose_axes(data, axes, asaxes='CTZYX'):
     return data
 
 
+def read_segments(fh, offsets, bytecounts):
+    """Return list of byte strings of the segments at offsets in file.
+
+    Runs of adjacent segments, e.g. the strips or tiles of a page written
+    by TiffWriter, are read with a single read call.
+
+    """
+    segments = [None] * len(offsets)
+    order = sorted(range(len(offsets)), key=lambda i: offsets[i])
+    start = 0
+    while start < len(order):
+        end = start + 1
+        while (end < len(order) and offsets[order[end]] ==
+               offsets[order[end-1]] + bytecounts[order[end-1]]):
+            end += 1
+        first = offsets[order[start]]
+        fh.seek(first)
+        data = fh.read(offsets[order[end-1]] + bytecounts[order[end-1]] -
+                       first)
+        for i in order[start:end]:
+            segments[i] = data[offsets[i]-first:
+                               offsets[i]-first+bytecounts[i]]
+        start = end
+    return segments
+
+
+def decode_parallel(decode, fh, offsets, bytecounts, maxworkers):
+    """Call decode(index, data) for each segment in file on threads."""
+    from concurrent.futures import ThreadPoolExecutor
+    segments = read_segments(fh, offsets, bytecounts)
+    with ThreadPoolExecutor(maxworkers) as executor:
+        # iterate over results to raise exceptions from decode
+        for _ in executor.map(decode, range(len(segments)), segments):
+            pass
+
+
 def stack_pages(pages, memmap=False, *args, **kwargs):
     """Read data from sequence of TiffPage and stack them vertically.
 
@@ -4402,6 +5171,7 @@ TIFF_TAGS = {
     323: ('tile_length', None, 4, 1, None),
     324: ('tile_offsets', None, 4, None, None),
     325: ('tile_byte_counts', None, 4, None, None),
+    330: ('sub_ifds', None, 4, None, None),
     338: ('extra_samples', None, 3, None,
           {0: 'unspecified', 1: 'assocalpha', 2: 'unassalpha'}),
     339: ('sample_format', 1, 3, 1, TIFF_SAMPLE_FORMATS),
@@ -1,5 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+
 from cellom2tif import cellom2tif
+from cellom2tif import tifffile as tif
+
 
 def test_start():
     cellom2tif.start()
     assert cellom2tif.VM_STARTED
+
+
+def test_iter_work_pending(tmpdir):
+    out_dir = str(tmpdir)
+    work = list(cellom2tif.iter_work('test-data', out_dir, ignore_masks=True))
+    assert len(work) == 36
+    assert not any(fin.endswith('o1.C01') for fin, fout in work)
+    assert os.path.isdir(os.path.join(out_dir, 'd3'))
+    fin, fout = work[0]
+    open(fout, 'w').close()
+    assert list(cellom2tif.pending(work)) == work[1:]
+
+
+def test_stack_channels(tmpdir):
+    out_dir = str(tmpdir)
+    work = cellom2tif.iter_work('test-data', out_dir, ignore_masks=True)
+    stacked = dict((fout, sources) for sources, fout
+                   in cellom2tif.stack_channels(work))
+    assert len(stacked) == 12
+    fout = os.path.join(out_dir, 'd3', 'AS_09125_050116110001_A01f00.tif')
+    assert [os.path.basename(fn) for fn in stacked[fout]] == [
+        'AS_09125_050116110001_A01f00d0.DIB',
+        'AS_09125_050116110001_A01f00d1.DIB',
+        'AS_09125_050116110001_A01f00d2.DIB']
+
+
+def test_read_into_tiff(tmpdir):
+    work = cellom2tif.iter_work('test-data', str(tmpdir), ignore_masks=True)
+    sources, fout = next(iter(cellom2tif.stack_channels(work)))
+    reader = lambda fn: cellom2tif.read_image(fn, backend='native')
+    assert not cellom2tif.read_into_tiff(sources, fout, reader, 1)
+    assert cellom2tif.read_into_tiff(sources, fout, reader, 0)
+    assert os.listdir(os.path.dirname(fout)) == [os.path.basename(fout)]
+    image = tif.imread(fout)
+    for i, source in enumerate(sources):
+        np.testing.assert_array_equal(image[i], reader(source))
+
+
+def test_write_image_partial(tmpdir):
+    fout = os.path.join(str(tmpdir), 'image.tif')
+    image = np.arange(6, dtype=np.uint16).reshape((2, 3))
+    try:
+        cellom2tif.write_image(fout, image, tiff_options={'tile': (5, 5)})
+    except ValueError:
+        pass
+    assert os.listdir(str(tmpdir)) == []
+    cellom2tif.write_image(fout, image)
+    assert os.listdir(str(tmpdir)) == ['image.tif']
+    np.testing.assert_array_equal(tif.imread(fout), image)
+
+
+def test_convert_files_output(tmpdir):
+    with pytest.raises(ValueError):
+        cellom2tif.convert_files(str(tmpdir), 'tests/cellomics_files',
+                                 ['image1.c01'], output='png')
+    pytest.importorskip('h5py')
+    cellom2tif.convert_files(str(tmpdir), 'test-data/d3',
+                             sorted(os.listdir('test-data/d3')),
+                             backend='native', output='hdf5')
+    assert os.listdir(str(tmpdir)) == ['AS_09125_050116110001.h5']
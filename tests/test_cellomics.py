@@ -0,0 +1,37 @@
+import os
+import zlib
+
+import numpy as np
+import pytest
+
+from cellom2tif import cellomics
+from cellom2tif import tifffile
+
+
+pairs = [('test-data/d1/MFGTMP_120628160001_C18f00d0.C01',
+          'test-data-results/d1/MFGTMP_120628160001_C18f00d0.tif'),
+         ('test-data/d1/MFGTMP_120628160001_C18f00o1.C01',
+          'test-data-results/d1/MFGTMP_120628160001_C18f00o1.tif'),
+         ('test-data/d3/AS_09125_050116110001_A01f00d0.DIB',
+          'test-data-results/d3/AS_09125_050116110001_A01f00d0.tif')]
+
+
+@pytest.mark.parametrize('fin, reference', pairs)
+def test_read_cellomics(fin, reference):
+    im = cellomics.read_cellomics(fin)
+    np.testing.assert_array_equal(im, tifffile.imread(reference))
+
+
+def test_unrecognized_variant(tmpdir):
+    with open(pairs[0][0], 'rb') as fin:
+        buf = zlib.decompress(fin.read()[4:])
+    fn = os.path.join(str(tmpdir), 'truncated.DIB')
+    with open(fn, 'wb') as fout:
+        fout.write(buf[:1000])
+    with pytest.raises(ValueError):
+        cellomics.read_cellomics(fn)
+    fn = os.path.join(str(tmpdir), 'corrupt.C01')
+    with open(fn, 'wb') as fout:
+        fout.write(b'\0' * 1000)
+    with pytest.raises(ValueError):
+        cellomics.read_cellomics(fn)
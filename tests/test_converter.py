@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pytest
+
+from cellom2tif import Converter
+from cellom2tif import tifffile
+
+
+cfile = 'test-data/d1/MFGTMP_120628160001_C18f00d0.C01'
+reference = 'test-data-results/d1/MFGTMP_120628160001_C18f00d0.tif'
+
+
+def test_convert_and_restart(tmpdir):
+    fout = os.path.join(str(tmpdir), 'out.tif')
+    with Converter() as converter:
+        converter.convert(cfile, fout)
+        np.testing.assert_array_equal(tifffile.imread(fout),
+                                      tifffile.imread(reference))
+        converter.restart()
+        assert converter.read(cfile).shape == (512, 512)
+
+
+def test_worker_errors_and_crashes():
+    with Converter(backend='native') as converter:
+        with pytest.raises(Exception):
+            converter.read('does-not-exist.C01')
+        converter._process.terminate()
+        converter._process.join()
+        with pytest.raises(RuntimeError):
+            converter.read(cfile)
+        assert converter.read(cfile).shape == (512, 512)
+
+
+def test_max_tasks():
+    with Converter(backend='native', max_tasks=2) as converter:
+        converter.read(cfile)
+        pid = converter._process.pid
+        converter.read(cfile)
+        assert converter._process is None
+        converter.read(cfile)
+        assert converter._process.pid != pid
+
+
+def test_timeout(tmpdir):
+    fifo = os.path.join(str(tmpdir), 'hangs.C01')
+    os.mkfifo(fifo)  # opening it for reading blocks forever
+    with Converter(backend='native', timeout=5) as converter:
+        converter.read(cfile)
+        with pytest.raises(RuntimeError):
+            converter.read(fifo)
+        assert converter._process is None
+        assert converter.read(cfile).shape == (512, 512)
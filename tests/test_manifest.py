@@ -0,0 +1,48 @@
+import os
+import shutil
+
+from cellom2tif.manifest import Manifest
+
+
+def test_manifest_reconverts_changed(tmpdir):
+    src = os.path.join(str(tmpdir), 'image1.c01')
+    shutil.copy('tests/cellomics_files/image1.c01', src)
+    fout = os.path.join(str(tmpdir), 'image1.tif')
+    db = os.path.join(str(tmpdir), 'manifest.sqlite')
+    with Manifest(db) as manifest:
+        assert list(manifest.pending([(src, fout)])) == [(src, fout)]
+        manifest.record(src, fout, 'done', seconds=0.5)
+    with Manifest(db) as manifest:
+        assert list(manifest.pending([(src, fout)])) == []
+        assert manifest.summary() == {'done': 1}
+        os.utime(src, (0, 0))
+        assert list(manifest.pending([(src, fout)])) == [(src, fout)]
+        manifest.record(src, fout, 'failed', error='ValueError: oops')
+    with Manifest(db) as manifest:
+        assert list(manifest.pending([(src, fout)])) == [(src, fout)]
+        assert manifest.summary() == {'failed': 1}
+
+
+def test_manifest_adopts_existing_output(tmpdir):
+    src = 'tests/cellomics_files/image1.c01'
+    fout = os.path.join(str(tmpdir), 'image1.tif')
+    open(fout, 'w').close()
+    with Manifest(os.path.join(str(tmpdir), 'manifest.sqlite')) as manifest:
+        assert list(manifest.pending([(src, fout)])) == []
+        assert manifest.summary() == {'done': 1}
+
+
+def test_manifest_uses_listing_stats(tmpdir, monkeypatch):
+    from cellom2tif import cellom2tif
+    stats = {}
+    work = list(cellom2tif.iter_work('tests/cellomics_files', str(tmpdir),
+                                     stats=stats))
+
+    def no_stat(path, *args, **kwargs):
+        raise AssertionError('stat of %s' % path)
+    with Manifest(':memory:') as manifest:
+        # the sources are only stat'ed by the directory listing
+        monkeypatch.setattr(os, 'stat', no_stat)
+        monkeypatch.setattr(os.path, 'getmtime', no_stat)
+        assert len(list(manifest.pending(work, stats=stats))) == 2
+        assert stats == {}
@@ -0,0 +1,35 @@
+import pytest
+
+from cellom2tif import memory
+
+
+GB = 2**30
+
+
+@pytest.fixture
+def sixteen_gb(monkeypatch):
+    monkeypatch.setattr(memory, 'system_memory', lambda: (16 * GB, 16 * GB))
+
+
+def test_system_memory():
+    total, available = memory.system_memory()
+    assert 0 < available <= total
+
+
+def test_heap_shared_between_workers(sixteen_gb):
+    assert memory.auto_heap_size(1) == '8192M'
+    assert memory.auto_heap_size(4) == '3072M'
+
+
+def test_heap_for_large_files(sixteen_gb):
+    assert memory.auto_heap_size(1, source_size=GB // 2) == '12288M'
+    with pytest.warns(UserWarning):
+        assert memory.auto_heap_size(8, source_size=GB // 2) == '1536M'
+
+
+def test_heap_budget_fixed(sixteen_gb, monkeypatch):
+    budget = memory.heap_budget()
+    # running JVMs reduce the available memory, but not the shares
+    monkeypatch.setattr(memory, 'system_memory', lambda: (16 * GB, 4 * GB))
+    assert memory.auto_heap_size(2, budget=budget) == '6144M'
+    assert memory.auto_heap_size(4, budget=budget) == '3072M'
@@ -4,6 +4,7 @@ from __future__ import print_function
 import os
 import sys
 import subprocess as sp
+import json
 import shutil
 from datetime import datetime as dt
 
@@ -119,3 +120,137 @@ def test_runtime(outdir):
     missing, not_equal = find_errors(indirs[1], resdir, ignore_masks=False)
     assert len(missing) == 0
     assert len(not_equal) == 0
+
+
+def test_runtime_native(outdir):
+    call = ['python', 'bin/cellom2tif']
+    flags = ['-b', 'native']
+    indirs = [test_data_dir, test_output_dir]
+    resdir = test_results_dir
+    cmd_line = call + flags + indirs
+    sp.call(cmd_line, shell=False)
+    missing, not_equal = find_errors(indirs[1], resdir, ignore_masks=False)
+    assert len(missing) == 0
+    assert len(not_equal) == 0
+
+
+def test_runtime_parallel(outdir):
+    call = ['python', 'bin/cellom2tif']
+    flags = ['-j', '2']
+    indirs = [test_data_dir, test_output_dir]
+    resdir = test_results_dir
+    cmd_line = call + flags + indirs
+    sp.call(cmd_line, shell=False)
+    missing, not_equal = find_errors(indirs[1], resdir, ignore_masks=False)
+    assert len(missing) == 0
+    assert len(not_equal) == 0
+
+
+def test_runtime_manifest(outdir):
+    call = ['python', 'bin/cellom2tif']
+    flags = ['-M']
+    indirs = [test_data_dir, test_output_dir]
+    resdir = test_results_dir
+    cmd_line = call + flags + indirs
+    sp.call(cmd_line, shell=False)
+    assert os.path.exists(os.path.join(test_output_dir, '.cellom2tif-manifest.sqlite'))
+    missing, not_equal = find_errors(indirs[1], resdir, ignore_masks=False)
+    assert len(missing) == 0
+    assert len(not_equal) == 0
+
+
+def test_runtime_pipeline(outdir):
+    call = ['python', 'bin/cellom2tif']
+    flags = ['-p']
+    indirs = [test_data_dir, test_output_dir]
+    resdir = test_results_dir
+    cmd_line = call + flags + indirs
+    sp.call(cmd_line, shell=False)
+    missing, not_equal = find_errors(indirs[1], resdir, ignore_masks=False)
+    assert len(missing) == 0
+    assert len(not_equal) == 0
+
+
+def test_runtime_stack_channels(outdir):
+    call = ['python', 'bin/cellom2tif']
+    flags = ['-s', '-b', 'native']
+    indirs = [test_data_dir, test_output_dir]
+    cmd_line = call + flags + indirs
+    sp.call(cmd_line, shell=False)
+    fn = 'MFGTMP_120628160001_C18f00'
+    stack = io.imread(os.path.join(test_output_dir, 'd1', fn + '.tif'))
+    assert stack.shape == (4, 512, 512)
+    for i, channel in enumerate(['d0', 'd1', 'd2', 'o1']):
+        reference = io.imread(os.path.join(test_results_dir, 'd1',
+                                           fn + channel + '.tif'))
+        np.testing.assert_array_equal(stack[i], reference)
+
+
+def test_runtime_montage(outdir):
+    call = ['python', 'bin/cellom2tif']
+    flags = ['-s', '-m', '--montage', '2x3', '-b', 'native',
+             '--threads', '2']
+    indirs = [test_data_dir, test_output_mask_dir]
+    cmd_line = call + flags + indirs
+    sp.call(cmd_line, shell=False)
+    fn = 'MFGTMP_120628160001_C18'
+    montage = io.imread(os.path.join(test_output_mask_dir, 'd1', fn + '.tif'))
+    assert montage.shape == (3, 2 * 512, 3 * 512)
+    assert np.all(montage[:, 512:] == 0)
+    for field in range(3):
+        for channel in range(3):
+            reference = io.imread(os.path.join(
+                test_results_mask_dir, 'd1',
+                fn + 'f%02id%i.tif' % (field, channel)))
+            np.testing.assert_array_equal(
+                montage[channel, :512, field*512:(field+1)*512], reference)
+
+
+def test_runtime_montage_auto(tmpdir):
+    outdir = str(tmpdir)
+    cmd_line = ['python', 'bin/cellom2tif', '-b', 'native', '--montage',
+                'auto', 'test-data/d3', outdir]
+    assert sp.call(cmd_line, shell=False) == 0
+    montage = io.imread(os.path.join(outdir,
+                                     'AS_09125_050116110001_A01d0.tif'))
+    assert montage.shape == (2 * 512, 3 * 512)
+
+
+def test_no_java_imports():
+    check = ("import sys, cellom2tif, cellom2tif.cellom2tif; "
+             "assert 'javabridge' not in sys.modules; "
+             "assert 'bioformats' not in sys.modules; "
+             "assert 'h5py' not in sys.modules")
+    assert sp.call(['python', '-c', check]) == 0
+
+
+def test_runtime_error_file(tmpdir):
+    indir = os.path.join(str(tmpdir), 'in')
+    outdir = os.path.join(str(tmpdir), 'out')
+    os.makedirs(indir)
+    good = 'MFGTMP_120628160001_C18f00d0.C01'
+    shutil.copy(os.path.join(test_data_dir, 'd1', good), indir)
+    with open(os.path.join(indir, 'corrupt.C01'), 'wb') as fout:
+        fout.write(b'\x00\x00\x00\x10 not an image')
+    error_file = os.path.join(str(tmpdir), 'errors.txt')
+    cmd_line = ['python', 'bin/cellom2tif', '-b', 'native', '-t', '60',
+                '-E', error_file, indir, outdir]
+    sp.call(cmd_line, shell=False)
+    assert os.listdir(outdir) == [good[:-4] + '.tif']
+    with open(error_file) as fin:
+        errors = fin.read().splitlines()
+    assert len(errors) == 1
+    assert errors[0].startswith(os.path.join(indir, 'corrupt.C01') + '\t')
+
+
+def test_runtime_zarr(tmpdir):
+    outdir = str(tmpdir)
+    cmd_line = ['python', 'bin/cellom2tif', '-f', 'zarr', '-b', 'native',
+                '-j', '2', test_data_dir, outdir]
+    sp.call(cmd_line, shell=False)
+    assert sorted(os.listdir(outdir)) == ['AS_09125_050116110001.zarr',
+                                          'MFGTMP_120628160001.zarr']
+    store = os.path.join(outdir, 'MFGTMP_120628160001.zarr')
+    with open(os.path.join(store, '.zarray')) as fin:
+        assert json.load(fin)['shape'] == [1, 6, 4, 512, 512]
+    assert len(os.listdir(store)) == 2 + 6 * 4
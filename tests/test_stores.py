@@ -0,0 +1,107 @@
+import os
+import json
+import zlib
+
+import numpy as np
+import pytest
+
+from cellom2tif import cellom2tif, stores
+from cellom2tif import tifffile
+
+
+def read_chunk(fn, dtype):
+    with open(fn, 'rb') as fin:
+        return np.frombuffer(zlib.decompress(fin.read()), dtype)
+
+
+def test_zarr_plate(tmpdir):
+    path = os.path.join(str(tmpdir), 'P.zarr')
+    plate = stores.ZarrPlate(path)
+    plate.set_image((2, 3), np.uint16)
+    assert plate.chunk('A01', '00', 'd0') == os.path.join(path, '0.0.0.0.0')
+    assert plate.chunk('A01', '01', 'd1') == os.path.join(path, '0.1.1.0.0')
+    image = np.arange(6, dtype=np.uint16).reshape((2, 3))
+    stores.write_zarr_chunk(plate.chunk('B02', '00', 'd1'), image)
+    with open(os.path.join(path, '.zarray')) as fin:
+        meta = json.load(fin)
+    assert meta['shape'] == [2, 2, 2, 2, 3]
+    assert meta['chunks'] == [1, 1, 1, 2, 3]
+    assert meta['dtype'] == '<u2'
+    np.testing.assert_array_equal(
+        read_chunk(os.path.join(path, '1.0.1.0.0'), '<u2'), image.ravel())
+    reopened = stores.ZarrPlate(path)
+    assert reopened.chunk('B02', '00', 'd1') == os.path.join(path, '1.0.1.0.0')
+    assert reopened.shape == (2, 3)
+
+
+def test_zarr_work(tmpdir):
+    out_dir = str(tmpdir)
+    plates = {}
+    work = cellom2tif.iter_work('test-data', out_dir, make_dirs=False)
+    work = list(stores.zarr_work(work, out_dir, plates))
+    assert sorted(plates) == ['AS_09125_050116110001', 'MFGTMP_120628160001']
+    assert not os.path.exists(os.path.join(out_dir, 'd1'))
+    plate = plates['MFGTMP_120628160001']
+    assert sorted(plate.labels['field']) == ['%02i' % i for i in range(6)]
+    assert plate.shape == (512, 512)
+    cellom2tif.convert_serial(work, backend='native')
+    fin = 'test-data/d2/MFGTMP_120628160001_C18f04d2.C01'
+    fout = dict(work)[fin]
+    reference = tifffile.imread(
+        'test-data-results/d2/MFGTMP_120628160001_C18f04d2.tif')
+    np.testing.assert_array_equal(read_chunk(fout, '<u2'), reference.ravel())
+
+
+def test_zarr_work_sorted_labels(tmpdir):
+    out_dir = str(tmpdir)
+    plates = {}
+    work = sorted(cellom2tif.iter_work('test-data/d3', out_dir,
+                                       make_dirs=False), reverse=True)
+    work = stores.zarr_work(work, out_dir, plates)
+    cellom2tif.convert_serial(work, backend='native')
+    plate = plates['AS_09125_050116110001']
+    assert plate.labels['field'] == ['%02i' % i for i in range(6)][::-1]
+    plate.close()
+    assert plate.labels['field'] == ['%02i' % i for i in range(6)]
+    assert plate.labels['channel'] == ['d0', 'd1', 'd2']
+    path = os.path.join(out_dir, 'AS_09125_050116110001.zarr')
+    with open(os.path.join(path, '.zattrs')) as fin:
+        assert json.load(fin)['fields'] == plate.labels['field']
+    assert len(os.listdir(path)) == 18 + 2
+    reference = tifffile.imread(
+        'test-data-results/d3/AS_09125_050116110001_A01f04d2.tif')
+    np.testing.assert_array_equal(
+        read_chunk(os.path.join(path, '0.4.2.0.0'), '<u2'),
+        reference.ravel())
+
+
+def test_hdf5_plate(tmpdir):
+    h5py = pytest.importorskip('h5py')
+    out_dir = str(tmpdir)
+    plates = {}
+    work = sorted(cellom2tif.iter_work('test-data/d3', out_dir,
+                                       make_dirs=False), reverse=True)
+    work = list(stores.hdf5_work(work, out_dir, plates))
+    assert len(work) == 18
+    for fin, fout in work:
+        stores.write_hdf5(plates, fin, cellom2tif.read_image(fin, 'native'))
+    for plate in plates.values():
+        plate.close()
+    fn = os.path.join(out_dir, 'AS_09125_050116110001.h5')
+    with h5py.File(fn, 'r') as f:
+        assert f['images'].shape == (1, 6, 3, 512, 512)
+        assert [stores._decode(field) for field in
+                f['images'].attrs['fields']] == ['%02i' % i for i in range(6)]
+        index = f['index'][:]
+        row = [r for r in index if r['field'] in (b'02', '02') and
+               r['channel'] in (b'd1', 'd1')][0]
+        assert tuple(row[dim + '_index'] for dim in
+                     ('well', 'field', 'channel')) == (0, 2, 1)
+        np.testing.assert_array_equal(
+            f['images'][0, 2, 1],
+            tifffile.imread('test-data-results/d3/'
+                            'AS_09125_050116110001_A01f02d1.tif'))
+    plates = {}
+    work = cellom2tif.iter_work('test-data/d3', out_dir, make_dirs=False)
+    assert list(stores.hdf5_work(work, out_dir, plates)) == []
+    plates['AS_09125_050116110001'].close()
@@ -0,0 +1,260 @@
+import io
+import sys
+import warnings
+
+import numpy as np
+
+from cellom2tif import tifffile
+
+
+def _roundtrip(data, **kwargs):
+    buf = io.BytesIO()
+    tifffile.imsave(buf, data, software='', **kwargs)
+    buf.seek(0)
+    with tifffile.TiffFile(buf) as tif:
+        return buf.getvalue(), tif.asarray()
+
+
+def test_parallel_compression():
+    data = np.random.randint(0, 4096, size=(4, 3, 64, 80)).astype(np.uint16)
+    serial, image = _roundtrip(data, compress=6)
+    parallel, image_p = _roundtrip(data, compress=6, maxworkers=4)
+    np.testing.assert_array_equal(image_p, data)
+    # same bytes, apart from the datetime tag
+    assert len(serial) == len(parallel)
+
+
+def test_tiled():
+    data = np.random.randint(0, 4096, size=(5, 100, 90)).astype(np.uint16)
+    _, image = _roundtrip(data, compress=6, tile=(32, 48))
+    np.testing.assert_array_equal(image, data)
+    buf = io.BytesIO()
+    tifffile.imsave(buf, data, tile=(32, 48))
+    buf.seek(0)
+    with tifffile.TiffFile(buf) as tif:
+        page = tif.pages[0]
+        assert page.is_tiled
+        assert len(tif.pages) == 5
+        assert len(page.tile_offsets) == 4 * 2
+        np.testing.assert_array_equal(tif.asarray(), data)
+
+
+def test_pyramid():
+    data = np.random.randint(0, 4096, size=(2, 100, 90)).astype(np.uint16)
+    buf = io.BytesIO()
+    tifffile.imsave(buf, data, compress=6, tile=(32, 32), pyramid=2)
+    buf.seek(0)
+    with tifffile.TiffFile(buf) as tif:
+        assert len(tif.pages) == 2
+        np.testing.assert_array_equal(tif.asarray(), data)
+        reduced = tif.pages[0].subifds
+        assert [page.shape for page in reduced] == [(50, 45), (25, 22)]
+        assert all(page.is_reduced and page.is_tiled for page in reduced)
+        level1 = data.reshape(2, 50, 2, 45, 2).mean(axis=(2, 4))
+        np.testing.assert_array_equal(tif.asarray(level=1),
+                                      np.round(level1 + 1e-9))
+        assert tif.asarray(level=2).shape == (2, 25, 22)
+
+
+def test_predictor():
+    ramp = np.add.outer(np.arange(100), np.arange(90)) * 40
+    data = np.stack([ramp, ramp[::-1]]).astype(np.uint16)
+    plain, _ = _roundtrip(data, compress=6)
+    predicted, image = _roundtrip(data, compress=6, predictor=True)
+    np.testing.assert_array_equal(image, data)
+    assert len(predicted) < len(plain)
+    _, image = _roundtrip(data, compress=1, predictor=True, tile=(32, 32))
+    np.testing.assert_array_equal(image, data)
+
+
+def test_rowsperstrip():
+    data = np.random.randint(0, 4096, size=(5, 101, 90)).astype(np.uint16)
+    serial, image = _roundtrip(data, compress=6, rowsperstrip=16)
+    np.testing.assert_array_equal(image, data)
+    parallel, image = _roundtrip(data, compress=6, rowsperstrip=16,
+                                 maxworkers=4)
+    np.testing.assert_array_equal(image, data)
+    assert len(serial) == len(parallel)
+    buf = io.BytesIO()
+    tifffile.imsave(buf, data, rowsperstrip=16)
+    buf.seek(0)
+    with tifffile.TiffFile(buf) as tif:
+        page = tif.pages[0]
+        assert page.rows_per_strip == 16
+        assert len(page.strip_offsets) == 7
+        assert page.strip_byte_counts[-1] == 5 * 90 * 2
+        np.testing.assert_array_equal(tif.asarray(), data)
+
+
+def test_memmap(tmpdir):
+    fn = str(tmpdir.join('memmap.tif'))
+    image = tifffile.memmap(fn, shape=(3, 100, 90), dtype='uint16',
+                            photometric='minisblack')
+    assert not image.any()
+    data = np.random.randint(0, 4096, size=(3, 100, 90)).astype(np.uint16)
+    image[:] = data
+    image.flush()
+    del image
+    with tifffile.TiffFile(fn) as tif:
+        assert len(tif.pages) == 3
+        mapped = tif.asarray(memmap=True)
+        assert isinstance(mapped, np.memmap) and mapped.filename == fn
+        np.testing.assert_array_equal(mapped, data)
+        del mapped
+    np.testing.assert_array_equal(tifffile.memmap(fn, page=1, mode='r'),
+                                  data[1])
+
+
+def test_parallel_decode():
+    ramp = np.add.outer(np.arange(101), np.arange(90)) % 2048
+    data = np.stack([ramp, ramp[::-1]]).astype(np.uint16)
+    for options in (dict(rowsperstrip=16), dict(tile=(32, 48))):
+        buf = io.BytesIO()
+        tifffile.imsave(buf, data, compress=6, predictor=True, **options)
+        buf.seek(0)
+        with tifffile.TiffFile(buf) as tif:
+            np.testing.assert_array_equal(tif.asarray(maxworkers=4), data)
+
+
+def test_decodepackbits():
+    # example from the TIFF 6.0 specification
+    encoded = bytes(bytearray([0xfe, 0xaa, 0x02, 0x80, 0x00, 0x2a, 0xfd,
+                               0xaa, 0x03, 0x80, 0x00, 0x2a, 0x22, 0xf7,
+                               0xaa]))
+    decoded = bytes(bytearray([0xaa, 0xaa, 0xaa, 0x80, 0x00, 0x2a, 0xaa,
+                               0xaa, 0xaa, 0xaa, 0x80, 0x00, 0x2a, 0x22] +
+                              [0xaa] * 10))
+    assert tifffile.decodepackbits(encoded) == decoded
+    # a truncated literal run and a no-op header
+    assert tifffile.decodepackbits(b'\x80\x03ab') == b'ab'
+
+
+def test_decodelzw():
+    # CLEAR, a, b, 258 (ab), 260 (not yet in the table), EOI
+    codes = [256, 97, 98, 258, 260, 257]
+    bits = ''.join('{0:09b}'.format(code) for code in codes)
+    bits += '0' * (-len(bits) % 8)
+    encoded = bytes(bytearray(int(bits[i:i+8], 2)
+                              for i in range(0, len(bits), 8)))
+    assert tifffile.decodelzw(encoded) == b'abababa'
+
+
+def _decodelzw_reference(encoded):
+    # the previous decoder: one code at a time, widening the codes when the
+    # table reaches 511, 1023 and 2047 entries
+    bits = ''.join('{0:08b}'.format(byte) for byte in bytearray(encoded))
+    bitcount, width, table, result = 0, 9, [], []
+    while True:
+        code = int(bits[bitcount:bitcount+width].ljust(width, '0'), 2)
+        bitcount += width
+        if code == 257 or bitcount >= len(bits):
+            break
+        if code == 256:
+            table = [bytes(bytearray([i])) for i in range(256)] + [b'', b'']
+            width = 9
+            code = int(bits[bitcount:bitcount+width].ljust(width, '0'), 2)
+            bitcount += width
+            if code == 257:
+                break
+            result.append(table[code])
+        else:
+            if code < len(table):
+                decoded = table[code]
+                newcode = table[oldcode] + decoded[:1]
+            else:
+                newcode = table[oldcode] + table[oldcode][:1]
+                decoded = newcode
+            result.append(decoded)
+            table.append(newcode)
+        oldcode = code
+        if len(table) in (511, 1023, 2047):
+            width += 1
+    return b''.join(result), code == 257
+
+
+def test_decodelzw_streams():
+    sys.path.insert(0, 'benchmarks')
+    try:
+        from benchmark import encode_lzw
+    finally:
+        sys.path.remove('benchmarks')
+    rng = np.random.RandomState(0)
+    streams = [
+        # codes reach 12 bits, and the table is cleared many times
+        rng.randint(0, 256, 20000).astype(np.uint8).tobytes(),
+        rng.randint(0, 4, 50000).astype(np.uint8).tobytes(),
+        # long runs: few codes, each decoding to many bytes
+        b'abcabcabd' * 3000 + bytes(bytearray(range(256))) * 8,
+    ]
+    for data in streams:
+        encoded = encode_lzw(data)
+        assert _decodelzw_reference(encoded) == (data, True)
+        assert tifffile.decodelzw(encoded) == data
+        # truncated mid-stream, and past the last table reset
+        for size in (len(encoded) // 3, len(encoded) - 2):
+            truncated = encoded[:size]
+            expected, complete = _decodelzw_reference(truncated)
+            assert not complete
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                assert tifffile.decodelzw(truncated) == expected
+            assert 'unexpected end of lzw stream' in str(caught[0].message)
+            assert data.startswith(expected)
+
+
+def test_accelerators():
+    report = tifffile.accelerators()
+    assert set(report) >= set(['decodelzw', 'decodepackbits', 'unpackints'])
+    for name, implementation in report.items():
+        accelerator = tifffile.ACCELERATORS[name]
+        assert accelerator[implementation] is getattr(tifffile, name)
+
+    # a module that exists is used, and one that does not is reported
+    def dumps(obj):
+        pass
+
+    def missing():
+        pass
+    try:
+        assert tifffile._replace_by('json.dumps')(dumps)([1]) == '[1]'
+        assert tifffile.accelerators()['dumps'] == 'native'
+        assert tifffile._replace_by('_no_such_module.missing')(missing) \
+            is missing
+        assert tifffile.accelerators()['missing'] == 'python'
+        assert tifffile.ACCELERATORS['missing']['error']
+    finally:
+        tifffile.ACCELERATORS.pop('dumps', None)
+        tifffile.ACCELERATORS.pop('missing', None)
+        vars(tifffile).pop('__old_dumps', None)
+
+
+def test_lazy_pages():
+    buf = io.BytesIO()
+    with tifffile.TiffWriter(buf) as tif:
+        for i in range(6):
+            tif.save(np.full((4, 5), i, np.uint8), description='page')
+    buf.seek(0)
+    with tifffile.TiffFile(buf) as tif:
+        # only the first page is parsed when the file is opened
+        assert tif.pages._pages == [tif.pages[0]]
+        assert tif.asarray(key=3)[0, 0] == 3
+        assert [page is not None for page in tif.pages._pages] == \
+            [True, False, False, True]
+        assert len(tif.pages) == 6
+        assert tif.pages[-1].index == 5
+        assert [page.asarray()[0, 0] for page in tif.pages] == list(range(6))
+
+
+def test_region():
+    data = np.random.randint(0, 4096, size=(3, 100, 90)).astype(np.uint16)
+    y0, y1, x0, x1 = region = (31, 65, 40, 89)
+    for kwargs in (dict(), dict(compress=6, rowsperstrip=7),
+                   dict(compress=6, predictor=True, tile=(32, 48))):
+        buf = io.BytesIO()
+        tifffile.imsave(buf, data, photometric='minisblack', **kwargs)
+        buf.seek(0)
+        with tifffile.TiffFile(buf) as tif:
+            np.testing.assert_array_equal(tif.pages[1].asarray(region=region),
+                                          data[1, y0:y1, x0:x1])
+            np.testing.assert_array_equal(tif.asarray(region=region),
+                                          data[:, y0:y1, x0:x1])
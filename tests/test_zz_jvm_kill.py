@@ -17,6 +17,13 @@ def test_read_image_from_reader():
     assert im.shape == (512, 512)
 
 
+def test_read_image_native():
+    im = cellom2tif.read_image(cfile, backend='native')
+    ref = cellom2tif.read_image(cfile)
+    assert im.shape == (512, 512)
+    assert (im == ref).all()
+
+
 def test_done():
     cellom2tif.done()
     assert cellom2tif.VM_KILLED
@@ -27,3 +34,8 @@ def test_vm_killed_error():
     with pytest.raises(RuntimeError) as err:
         cellom2tif.read_image(cfile)
     assert err.value.args[0].startswith('The Java Virtual Machine')
+
+
+def test_native_after_vm_killed():
+    im = cellom2tif.read_image(cfile, backend='native')
+    assert im.shape == (512, 512)